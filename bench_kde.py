@@ -0,0 +1,67 @@
+"""
+核密度估计性能对比
+
+在连云港范围内生成聚集分布的模拟案件点(与bench_spatial.py相同), 比较FFT核密度估计(kde.py)
+与逐点核函数求和(每个点对支撑半径内的所有格子中心累加核函数值)的耗时,
+以及两者结果的最大差异(相对于最大密度)。逐点求和在大数据量下很慢, 超过上限时跳过。
+
+用法:
+    python bench_kde.py [点数 ...]      默认 1000 10000 100000 1000000 10000000
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from bench_spatial import synthetic_points
+from kde import DEFAULT_BANDWIDTH, kde, kernel_support, kernel_values
+from spatial_index import METRES_PER_DEGREE
+
+NAIVE_MAX_POINTS = 100_000
+CHUNK = 2000
+
+
+def naive_density(lng, lat, surface):
+    """逐点核函数求和, 在surface的格子中心求值, 单位与kde相同(案件/平方公里)"""
+    ny, nx = surface.shape
+    cell = surface.dy * METRES_PER_DEGREE
+    metres_x = surface.dx * METRES_PER_DEGREE * np.cos(np.radians(surface.south + ny * surface.dy / 2))
+    r = int(np.ceil(kernel_support(surface.bandwidth, surface.kernel) / cell))
+    ox, oy = (v.ravel() for v in np.meshgrid(np.arange(-r, r + 1), np.arange(-r, r + 1)))
+    density = np.zeros(ny * nx)
+    for start in range(0, len(lng), CHUNK):
+        fx = (lng[start:start + CHUNK] - surface.west) / surface.dx - 0.5
+        fy = (lat[start:start + CHUNK] - surface.south) / surface.dy - 0.5
+        cx = np.round(fx).astype(np.int64)[:, None] + ox
+        cy = np.round(fy).astype(np.int64)[:, None] + oy
+        distance = np.hypot((cx - fx[:, None]) * metres_x, (cy - fy[:, None]) * cell)
+        keep = (cx >= 0) & (cx < nx) & (cy >= 0) & (cy < ny)
+        values = kernel_values(distance[keep], surface.bandwidth, surface.kernel) * 1e6
+        density += np.bincount((cy * nx + cx)[keep], weights=values, minlength=ny * nx)
+    return density.reshape(ny, nx)
+
+
+def run(n, bandwidth=DEFAULT_BANDWIDTH):
+    lng, lat = synthetic_points(n)
+    print(f"\n{n:,} 个点, 带宽 {bandwidth:.0f} 米")
+    print(f"{'核函数':<16}{'网格':>12}{'FFT(毫秒)':>12}{'逐点求和(毫秒)':>16}{'加速':>8}{'最大相对误差':>14}")
+    for kernel in ('gaussian', 'epanechnikov'):
+        start = time.perf_counter()
+        surface = kde(lng, lat, bandwidth, kernel=kernel)
+        fft_ms = (time.perf_counter() - start) * 1000
+        grid = f"{surface.shape[1]}x{surface.shape[0]}"
+        if n > NAIVE_MAX_POINTS:
+            print(f"{kernel:<16}{grid:>12}{fft_ms:>12.1f}{'-':>16}{'-':>8}{'-':>14}")
+            continue
+        start = time.perf_counter()
+        reference = naive_density(lng, lat, surface)
+        naive_ms = (time.perf_counter() - start) * 1000
+        error = np.abs(surface.density - reference).max() / reference.max()
+        print(f"{kernel:<16}{grid:>12}{fft_ms:>12.1f}{naive_ms:>16.1f}{naive_ms / fft_ms:>7.0f}x{error:>14.4f}")
+
+
+if __name__ == '__main__':
+    sizes = [int(float(v)) for v in sys.argv[1:]] or [1000, 10_000, 100_000, 1_000_000, 10_000_000]
+    for size in sizes:
+        run(size)
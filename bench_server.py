@@ -0,0 +1,131 @@
+"""
+服务器并发性能对比
+
+在本机启动原来的单线程 socketserver.TCPServer 和线程池 PooledHTTPServer,
+两者都使用mobile_server实际的请求处理器(只关闭访问日志), 用若干并发客户端请求静态资源, 同时用几个慢速客户端(请求头分段慢慢发送, 模拟弱网手机)占用连接,
+比较吞吐量和 p50/p99 延迟。
+
+用法:
+    python bench_server.py [并发客户端数] [每个客户端请求数] [慢速客户端数]
+"""
+
+import http.client
+import socket
+import socketserver
+import sys
+import threading
+import time
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+
+from mobile_server import MobileHTTPRequestHandler
+from serving import PooledHTTPServer
+
+ROOT = Path(__file__).resolve().parent
+PATHS = ('/index.html', '/data.v2.json', '/data.bin', '/shards/manifest.json')
+# 慢速客户端发送一个请求头用的时间(秒)
+SLOW_SEND_SECONDS = 0.5
+
+
+class QuietHandler(MobileHTTPRequestHandler):
+    """mobile_server的请求处理器, 不输出访问日志"""
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SingleThreadServer(socketserver.TCPServer):
+    """原来的服务方式"""
+    allow_reuse_address = True
+
+
+def _slow_client(port, stop):
+    """逐字节慢慢发送请求头, 发送完再读取响应, 循环直到结束"""
+    request = f"GET {PATHS[1]} HTTP/1.0\r\nHost: localhost\r\n\r\n".encode()
+    delay = SLOW_SEND_SECONDS / len(request)
+    while not stop.is_set():
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=10) as s:
+                for i in range(len(request)):
+                    s.sendall(request[i:i + 1])
+                    time.sleep(delay)
+                while s.recv(65536):
+                    pass
+        except OSError:
+            time.sleep(0.05)
+
+
+def _client(port, requests, latencies, errors):
+    for i in range(requests):
+        path = PATHS[i % len(PATHS)]
+        start = time.perf_counter()
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            conn.close()
+            if response.status != 200:
+                errors.append(response.status)
+                continue
+        except OSError as e:
+            errors.append(type(e).__name__)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+def run(server_factory, clients, requests, slow_clients):
+    """返回 (吞吐量 请求/秒, p50毫秒, p99毫秒, 错误数)"""
+    handler = partial(QuietHandler, directory=str(ROOT))
+    httpd = server_factory(('127.0.0.1', 0), handler)
+    port = httpd.server_address[1]
+    server_thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    server_thread.start()
+
+    stop = threading.Event()
+    slow = [threading.Thread(target=_slow_client, args=(port, stop), daemon=True)
+            for _ in range(slow_clients)]
+    for t in slow:
+        t.start()
+    time.sleep(0.1)
+
+    latencies, errors = [], []
+    threads = [threading.Thread(target=_client, args=(port, requests, latencies, errors))
+               for _ in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    httpd.shutdown()
+    httpd.server_close()
+    ms = np.array(latencies) * 1000
+    if not len(ms):
+        return 0.0, float('nan'), float('nan'), len(errors)
+    return len(ms) / elapsed, float(np.percentile(ms, 50)), float(np.percentile(ms, 99)), len(errors)
+
+
+def main():
+    args = [int(v) for v in sys.argv[1:4]]
+    clients = args[0] if args else 16
+    requests = args[1] if len(args) > 1 else 25
+    slow_clients = args[2] if len(args) > 2 else 2
+
+    print(f"{clients} 个并发客户端 x {requests} 个请求, {slow_clients} 个慢速客户端")
+    print(f"{'服务器':<24}{'吞吐量(请求/秒)':>16}{'p50(毫秒)':>12}{'p99(毫秒)':>12}{'错误':>6}")
+    servers = (
+        ('TCPServer(单线程)', SingleThreadServer),
+        ('PooledHTTPServer', PooledHTTPServer),
+    )
+    for name, factory in servers:
+        throughput, p50, p99, errors = run(factory, clients, requests, slow_clients)
+        print(f"{name:<24}{throughput:>16.1f}{p50:>12.1f}{p99:>12.1f}{errors:>6}")
+
+
+if __name__ == '__main__':
+    main()
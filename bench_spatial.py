@@ -0,0 +1,103 @@
+"""
+空间索引性能对比
+
+在连云港范围内生成聚集分布的模拟案件点, 比较网格索引与线性扫描在
+矩形范围(约一屏, 缩放14级)、半径500米和10近邻查询上的耗时, 以及索引的建立、保存和加载时间。
+
+用法:
+    python bench_spatial.py [点数 ...]      默认 10000 1000000 10000000
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from spatial_index import SpatialGrid, haversine
+
+# 连云港市区范围, 与index.html中的lianyungangBounds一致
+WEST, SOUTH, EAST, NORTH = 119.1453, 34.3665, 119.3549, 34.6690
+QUERIES = 50
+VIEW_WIDTH, VIEW_HEIGHT = 0.03, 0.02
+RADIUS = 500.0
+K = 10
+
+
+def synthetic_points(n, seed=0):
+    """若干热点附近的正态分布 + 20%均匀分布的背景点"""
+    rng = np.random.default_rng(seed)
+    hotspots = rng.uniform([WEST, SOUTH], [EAST, NORTH], size=(40, 2))
+    clustered = int(n * 0.8)
+    centres = hotspots[rng.integers(0, len(hotspots), clustered)]
+    points = np.vstack([centres + rng.normal(0, 0.01, (clustered, 2)),
+                        rng.uniform([WEST, SOUTH], [EAST, NORTH], (n - clustered, 2))])
+    return points[:, 0].copy(), points[:, 1].copy()
+
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        func(i)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def run(n):
+    lng, lat = synthetic_points(n)
+    rng = np.random.default_rng(1)
+    centres = rng.uniform([WEST + 0.02, SOUTH + 0.02], [EAST - 0.02, NORTH - 0.02], (QUERIES, 2))
+
+    start = time.perf_counter()
+    grid = SpatialGrid.build(lng, lat)
+    build = time.perf_counter() - start
+    path = os.path.join(tempfile.mkdtemp(), 'spatial.npz')
+    start = time.perf_counter()
+    grid.save(path)
+    save = time.perf_counter() - start
+    start = time.perf_counter()
+    SpatialGrid.load(path, lng, lat)
+    load = time.perf_counter() - start
+    os.remove(path)
+
+    def bbox_index(i):
+        x, y = centres[i]
+        grid.query_bbox(x - VIEW_WIDTH / 2, y - VIEW_HEIGHT / 2, x + VIEW_WIDTH / 2, y + VIEW_HEIGHT / 2)
+
+    def bbox_scan(i):
+        x, y = centres[i]
+        np.flatnonzero((lng >= x - VIEW_WIDTH / 2) & (lng <= x + VIEW_WIDTH / 2)
+                       & (lat >= y - VIEW_HEIGHT / 2) & (lat <= y + VIEW_HEIGHT / 2))
+
+    def radius_index(i):
+        grid.query_radius(*centres[i], RADIUS)
+
+    def radius_scan(i):
+        dist = haversine(lng, lat, *centres[i])
+        np.flatnonzero(dist <= RADIUS)
+
+    def knn_index(i):
+        grid.knn(*centres[i], K)
+
+    def knn_scan(i):
+        dist = haversine(lng, lat, *centres[i])
+        nearest = np.argpartition(dist, K)[:K]
+        nearest[np.argsort(dist[nearest])]
+
+    # 大数据量下线性扫描很慢, 减少重复次数
+    scan_repeat = max(3, min(QUERIES, int(QUERIES * 1e6 / n)))
+    print(f"\n{n:,} 个点: 网格 {grid.nx}x{grid.ny}, 格子边长 {grid.dy * 111195:.0f} 米; "
+          f"建立 {build * 1000:.0f} 毫秒, 保存 {save * 1000:.0f} 毫秒, 加载 {load * 1000:.0f} 毫秒")
+    print(f"{'查询':<16}{'网格索引(毫秒)':>16}{'线性扫描(毫秒)':>16}{'加速':>10}")
+    for name, index_query, scan_query in (('矩形范围', bbox_index, bbox_scan),
+                                          (f'半径{RADIUS:.0f}米', radius_index, radius_scan),
+                                          (f'{K}近邻', knn_index, knn_scan)):
+        indexed = timed(index_query, QUERIES)
+        scanned = timed(scan_query, scan_repeat)
+        print(f"{name:<16}{indexed:>16.3f}{scanned:>16.3f}{scanned / indexed:>9.0f}x")
+
+
+if __name__ == '__main__':
+    sizes = [int(float(v)) for v in sys.argv[1:]] or [10_000, 1_000_000, 10_000_000]
+    for size in sizes:
+        run(size)
@@ -0,0 +1,200 @@
+"""
+解析结果缓存
+
+以工作簿内容哈希 + 清洗规则版本 + 必要列为键, 将清洗后的列式数据保存为.npy文件,
+源文件未变化时直接内存映射加载, 跳过Excel解析。
+服务器的数据快照(server_data.py, 含其中的空间索引)也是缓存条目, 一起计入容量并按最近最少使用淘汰;
+缓存目录下的其他内容(如raster/瓦片缓存)不属于本缓存, 清空和淘汰时保持不动。
+
+用法:
+    python data_cache.py list            查看缓存
+    python data_cache.py clear           清空缓存
+    python data_cache.py evict [MB] [天]  按总大小和存放时间淘汰
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from incident_table import CLEANING_VERSION, TIME_COLUMNS, IncidentTable
+from ingest import load_excel_streaming
+
+DEFAULT_CACHE_DIR = Path(__file__).resolve().parent / '.heatmap_cache'
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+DEFAULT_MAX_AGE = 30 * 24 * 3600
+
+# 每个字段对应的文件名
+ARRAY_FILES = {'lng': 'lng.npy', 'lat': 'lat.npy', 'codes': 'codes.npy'}
+TIME_FILES = {name: f'time{i}.npy' for i, name in enumerate(TIME_COLUMNS)}
+
+
+def file_digest(path, block_size=1024 * 1024):
+    """计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DataCache:
+    """基于内容哈希的解析结果缓存"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+
+    def _digest(self, path):
+        """按 (路径, 大小, 修改时间) 记住哈希值, 文件未变时不必重新读取整个文件"""
+        path = Path(path).resolve()
+        stat = path.stat()
+        stamp = f"{path}|{stat.st_size}|{stat.st_mtime_ns}"
+        index_file = self.cache_dir / 'digests.json'
+        try:
+            index = json.loads(index_file.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            index = {}
+        if stamp not in index:
+            index = {k: v for k, v in index.items() if not k.startswith(f"{path}|")}
+            index[stamp] = file_digest(path)
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            index_file.write_text(json.dumps(index, ensure_ascii=False), encoding='utf-8')
+        return index[stamp]
+
+    def key_for(self, path, required=('经度', '纬度')):
+        """缓存键: 内容哈希 + 清洗规则版本 + 必要列"""
+        parts = [self._digest(path), f"v{CLEANING_VERSION}", ','.join(required)]
+        return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()[:32]
+
+    def get(self, key):
+        """读取缓存, 数组以只读内存映射方式打开; 未命中返回None"""
+        entry = self.cache_dir / key
+        try:
+            meta = json.loads((entry / 'meta.json').read_text(encoding='utf-8'))
+            arrays = {name: np.load(entry / filename, mmap_mode='r')
+                      for name, filename in ARRAY_FILES.items()}
+            times = {name: np.load(entry / filename, mmap_mode='r')
+                     for name, filename in TIME_FILES.items()}
+        except (OSError, ValueError):
+            return None
+        # 更新修改时间, 供按时间淘汰使用
+        os.utime(entry)
+        return IncidentTable(arrays['lng'], arrays['lat'], times, arrays['codes'], meta['categories'])
+
+    def put(self, key, table, source=None):
+        """写入缓存, 先写临时目录再原子重命名"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        entry = self.cache_dir / key
+        tmp = self.cache_dir / f".{key}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir()
+        np.save(tmp / ARRAY_FILES['lng'], table.lng)
+        np.save(tmp / ARRAY_FILES['lat'], table.lat)
+        np.save(tmp / ARRAY_FILES['codes'], table.codes)
+        for name, filename in TIME_FILES.items():
+            np.save(tmp / filename, table.times[name])
+        meta = {
+            'categories': table.categories,
+            'rows': len(table),
+            'source': str(source) if source else None,
+            'created': time.time(),
+            'cleaning_version': CLEANING_VERSION,
+        }
+        (tmp / 'meta.json').write_text(json.dumps(meta, ensure_ascii=False), encoding='utf-8')
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp, entry)
+
+    def entries(self):
+        """列出缓存条目, 按最近使用时间降序"""
+        if not self.cache_dir.exists():
+            return []
+        result = []
+        for entry in self.cache_dir.iterdir():
+            meta_file = entry / 'meta.json'
+            if not entry.is_dir() or not meta_file.exists():
+                continue
+            meta = json.loads(meta_file.read_text(encoding='utf-8'))
+            size = sum(f.stat().st_size for f in entry.iterdir())
+            result.append({
+                'key': entry.name,
+                'source': meta.get('source'),
+                'rows': meta.get('rows'),
+                'bytes': size,
+                'last_used': entry.stat().st_mtime,
+            })
+        result.sort(key=lambda e: e['last_used'], reverse=True)
+        return result
+
+    def evict(self, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE):
+        """淘汰过期条目, 再按最近最少使用淘汰直到总大小不超过上限"""
+        now = time.time()
+        total = 0
+        removed = []
+        for entry in self.entries():
+            if now - entry['last_used'] > max_age or total + entry['bytes'] > max_bytes:
+                shutil.rmtree(self.cache_dir / entry['key'], ignore_errors=True)
+                removed.append(entry['key'])
+            else:
+                total += entry['bytes']
+        return removed
+
+    def clear(self):
+        """删除全部缓存条目、未完成的临时目录和哈希索引"""
+        for entry in self.entries():
+            shutil.rmtree(self.cache_dir / entry['key'], ignore_errors=True)
+        if self.cache_dir.exists():
+            for tmp in self.cache_dir.glob('.*.tmp'):
+                shutil.rmtree(tmp, ignore_errors=True)
+        try:
+            (self.cache_dir / 'digests.json').unlink()
+        except OSError:
+            pass
+
+
+def load_excel_cached(path, required=('经度', '纬度'), chunk_size=None, cache=None, verbose=True):
+    """带缓存加载Excel; 未命中时解析并写入缓存"""
+    cache = cache or DataCache()
+    key = cache.key_for(path, required)
+    table = cache.get(key)
+    if table is not None:
+        if verbose:
+            print(f"命中缓存: {key}")
+        return table
+
+    if chunk_size:
+        table = load_excel_streaming(path, required, chunk_size, verbose=verbose)
+    else:
+        table = IncidentTable.from_excel(path, required)
+    cache.put(key, table, source=Path(path).resolve())
+    cache.evict()
+    return table
+
+
+def main(argv):
+    cache = DataCache()
+    command = argv[1] if len(argv) > 1 else 'list'
+    if command == 'list':
+        entries = cache.entries()
+        for entry in entries:
+            used = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['last_used']))
+            print(f"{entry['key']}  {entry['rows']:>10} 行  {entry['bytes'] / 1024:>10.1f} KB  {used}  {entry['source']}")
+        print(f"共 {len(entries)} 个缓存条目, {sum(e['bytes'] for e in entries) / 1024 / 1024:.2f} MB")
+    elif command == 'clear':
+        cache.clear()
+        print(f"缓存已清空: {cache.cache_dir}")
+    elif command == 'evict':
+        max_bytes = float(argv[2]) * 1024 * 1024 if len(argv) > 2 else DEFAULT_MAX_BYTES
+        max_age = float(argv[3]) * 24 * 3600 if len(argv) > 3 else DEFAULT_MAX_AGE
+        removed = cache.evict(max_bytes, max_age)
+        print(f"已淘汰 {len(removed)} 个缓存条目")
+    else:
+        print(__doc__)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,321 @@
+"""
+前端数据导出
+
+data.v2.json: 列式(struct-of-arrays)紧凑格式
+    - 记录按处警时间排序
+    - 案件类别为字典 + 整数编码
+    - 经纬度量化为1e-5度的整数, 再减去最小值
+    - 处警时间为相对前一条的差分秒数, 案发时间上下限为相对处警时间的偏移秒数
+    - 时间均按墙上时间解释, 不做时区换算; 缺失值为null
+
+data.bin: 二进制类型化数组格式, 前端直接以TypedArray视图读取, 不逐条分配对象
+    魔数 b'LYGH' | uint32 头部长度 | UTF-8 JSON头部 | 填充到4字节对齐 | 各列数据
+    列依次为 float32 纬度、float32 经度、uint32 处警时间偏移(相对time_base)、
+    int32 案发时间下限/上限偏移(相对处警时间)、uint16 类别编码; 均为小端序。
+    缺失值: uint32为0xFFFFFFFF, int32为-2^31, uint16为0xFFFF。
+
+shards/: 按月(或按周)切分的data.bin分片, 文件名带内容哈希, 可长期缓存;
+    分片头部不含数据版本, 类别字典只包含本分片用到的类别, 分片内容只取决于该月的记录,
+    新数据只改变它所在月份的分片。shards/manifest.json记录数据版本、每个分片的行数、
+    时间范围和哈希, 以及全部类别; 前端只下载与所选时间窗口重叠的分片, 按类别名合并编码。
+    增量导入时append_shards只重写新记录所在月份的分片并更新清单。
+"""
+
+import hashlib
+import json
+import struct
+from pathlib import Path
+
+import numpy as np
+
+from incident_table import NAT, IncidentTable
+
+COMPACT_FORMAT = 'incidents-v2'
+COMPACT_FILE = 'data.v2.json'
+
+# 坐标定点量化倍数, 1e-5度约1米
+COORD_SCALE = 100000
+
+BINARY_FILE = 'data.bin'
+BINARY_MAGIC = b'LYGH'
+BINARY_VERSION = 1
+# (字段名, 小端dtype); 4字节字段在前, 保证每列按元素大小对齐
+BINARY_FIELDS = (
+    ('lat', '<f4'),
+    ('lng', '<f4'),
+    ('time', '<u4'),
+    ('start', '<i4'),
+    ('end', '<i4'),
+    ('code', '<u2'),
+)
+MISSING_U4 = 0xFFFFFFFF
+MISSING_I4 = -2 ** 31
+MISSING_U2 = 0xFFFF
+
+SHARD_DIR = 'shards'
+MANIFEST_FILE = 'manifest.json'
+SHARD_PERIODS = ('month', 'week')
+
+
+def _nullable(values, missing):
+    """转换为列表, 缺失位置为None"""
+    result = values.astype(object)
+    result[missing] = None
+    return result.tolist()
+
+
+def time_order(table):
+    """按处警时间排序的下标, 缺失值排在最后"""
+    alarm = table.times['处警时间']
+    return np.argsort(np.where(alarm == NAT, np.iinfo(np.int64).max, alarm), kind='stable')
+
+
+def compact_payload(table, version=0):
+    """构建v2紧凑格式的字典"""
+    order = time_order(table)
+    alarm = table.times['处警时间'][order]
+    present = alarm != NAT
+
+    lng = np.round(table.lng[order] * COORD_SCALE).astype(np.int64)
+    lat = np.round(table.lat[order] * COORD_SCALE).astype(np.int64)
+    lng_base = int(lng.min()) if len(lng) else 0
+    lat_base = int(lat.min()) if len(lat) else 0
+
+    time_base = int(alarm[present][0]) if present.any() else 0
+    # 差分只在非缺失值之间计算
+    deltas = np.zeros(len(alarm), dtype=np.int64)
+    deltas[present] = np.diff(alarm[present], prepend=time_base)
+    anchor = np.where(present, alarm, time_base)
+
+    payload = {
+        'format': COMPACT_FORMAT,
+        'version': version,
+        'count': len(table),
+        'categories': table.categories,
+        'scale': COORD_SCALE,
+        'lng_base': lng_base,
+        'lat_base': lat_base,
+        'time_base': time_base,
+        'lng': (lng - lng_base).tolist(),
+        'lat': (lat - lat_base).tolist(),
+        'code': table.codes[order].tolist(),
+        'time': _nullable(deltas, ~present),
+    }
+    for key, name in (('start', '案发时间下限'), ('end', '案发时间上限')):
+        values = table.times[name][order]
+        payload[key] = _nullable(anchor - values, values == NAT)
+    return payload
+
+
+def write_compact_json(table, path=COMPACT_FILE, version=0):
+    """写出v2紧凑格式, 不缩进以减小体积"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(compact_payload(table, version), f, ensure_ascii=False, separators=(',', ':'))
+    return Path(path)
+
+
+def load_compact_json(path=COMPACT_FILE):
+    """读取v2紧凑格式为IncidentTable"""
+    with open(path, 'r', encoding='utf-8') as f:
+        payload = json.load(f)
+    if payload.get('format') != COMPACT_FORMAT:
+        raise ValueError(f"{path} 不是 {COMPACT_FORMAT} 格式")
+
+    def column(key):
+        values = payload[key]
+        missing = np.array([v is None for v in values], dtype=bool)
+        return np.array([0 if v is None else v for v in values], dtype=np.int64), missing
+
+    deltas, time_missing = column('time')
+    alarm = payload['time_base'] + np.cumsum(deltas)
+    anchor = np.where(time_missing, payload['time_base'], alarm)
+    times = {'处警时间': np.where(time_missing, NAT, alarm)}
+    for key, name in (('start', '案发时间下限'), ('end', '案发时间上限')):
+        offsets, missing = column(key)
+        times[name] = np.where(missing, NAT, anchor - offsets)
+
+    scale = payload['scale']
+    lng = (np.asarray(payload['lng'], dtype=np.int64) + payload['lng_base']) / scale
+    lat = (np.asarray(payload['lat'], dtype=np.int64) + payload['lat_base']) / scale
+    return IncidentTable(lng, lat, times, np.asarray(payload['code'], dtype=np.int32),
+                         payload['categories'])
+
+
+def binary_columns(table):
+    """构建二进制格式的各列数组, 返回 (time_base, {字段名: 数组})"""
+    order = time_order(table)
+    alarm = table.times['处警时间'][order]
+    present = alarm != NAT
+    time_base = int(alarm[present][0]) if present.any() else 0
+    anchor = np.where(present, alarm, time_base)
+
+    columns = {
+        'lat': table.lat[order],
+        'lng': table.lng[order],
+        'time': np.where(present, alarm - time_base, MISSING_U4),
+        'code': np.where(table.codes[order] >= 0, table.codes[order], MISSING_U2),
+    }
+    for key, name in (('start', '案发时间下限'), ('end', '案发时间上限')):
+        values = table.times[name][order]
+        columns[key] = np.where(values == NAT, MISSING_I4, anchor - values)
+    return time_base, {key: columns[key].astype(dtype) for key, dtype in BINARY_FIELDS}
+
+
+def encode_binary(table, version=None):
+    """编码为data.bin格式的字节串; version为None时头部不写版本(分片)"""
+    time_base, columns = binary_columns(table)
+    header = {'format': BINARY_VERSION}
+    if version is not None:
+        header['version'] = version
+    header.update({
+        'count': len(table),
+        'categories': table.categories,
+        'time_base': time_base,
+        'fields': [[key, dtype[1:]] for key, dtype in BINARY_FIELDS],
+    })
+    header = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    header += b' ' * (-(len(BINARY_MAGIC) + 4 + len(header)) % 4)
+    parts = [BINARY_MAGIC, struct.pack('<I', len(header)), header]
+    parts.extend(columns[key].tobytes() for key, _ in BINARY_FIELDS)
+    return b''.join(parts)
+
+
+def decode_binary(data):
+    """data.bin格式的字节串 -> (头部, IncidentTable); 经纬度为float32精度"""
+    if data[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+        raise ValueError("不是data.bin格式")
+    offset = len(BINARY_MAGIC) + 4
+    (length,) = struct.unpack('<I', data[len(BINARY_MAGIC):offset])
+    header = json.loads(data[offset:offset + length].decode('utf-8'))
+    offset += length
+    count = header['count']
+    columns = {}
+    for key, dtype in BINARY_FIELDS:
+        columns[key] = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+        offset += count * np.dtype(dtype).itemsize
+
+    missing = columns['time'] == MISSING_U4
+    anchor = header['time_base'] + np.where(missing, 0, columns['time']).astype(np.int64)
+    times = {'处警时间': np.where(missing, NAT, anchor)}
+    for key, name in (('start', '案发时间下限'), ('end', '案发时间上限')):
+        values = columns[key].astype(np.int64)
+        times[name] = np.where(values == MISSING_I4, NAT, anchor - values)
+    codes = np.where(columns['code'] == MISSING_U2, -1, columns['code']).astype(np.int32)
+    table = IncidentTable(columns['lng'].astype(np.float64), columns['lat'].astype(np.float64),
+                          times, codes, header['categories'])
+    return header, table
+
+
+def write_binary(table, path=BINARY_FILE, version=0):
+    """写出data.bin"""
+    Path(path).write_bytes(encode_binary(table, version))
+    return Path(path)
+
+
+def partition_keys(seconds, period='month'):
+    """时间戳所属的分区名: 月为 'YYYY-MM', 周为周一日期 'YYYY-MM-DD'; 缺失为 'undated'"""
+    if period not in SHARD_PERIODS:
+        raise ValueError(f"不支持的分片周期: {period}")
+    seconds = np.asarray(seconds, dtype=np.int64)
+    missing = seconds == NAT
+    stamps = np.where(missing, 0, seconds).astype('datetime64[s]')
+    if period == 'month':
+        keys = np.datetime_as_string(stamps.astype('datetime64[M]'))
+    else:
+        # 1970-01-01是周四, 加3天后按7天取整即对齐到周一
+        days = stamps.astype('datetime64[D]').astype(np.int64)
+        keys = np.datetime_as_string(((days + 3) // 7 * 7 - 3).astype('datetime64[D]'))
+    keys = keys.astype(object)
+    keys[missing] = 'undated'
+    return keys
+
+
+def write_shards(table, directory=SHARD_DIR, period='month', version=0):
+    """按时间分片写出二进制数据和清单, 内容未变的分片文件保持不动"""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    alarm = table.times['处警时间']
+    keys = partition_keys(alarm, period)
+    labels, inverse = np.unique(keys.astype(str), return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    bounds = np.searchsorted(inverse[order], np.arange(len(labels) + 1))
+
+    shards = [_write_shard(directory, str(label), table.take(order[bounds[i]:bounds[i + 1]]))
+              for i, label in enumerate(labels)]
+    manifest = {
+        'version': version,
+        'period': period,
+        'rows': len(table),
+        'categories': table.categories,
+        'shards': shards,
+    }
+    _write_manifest(directory, manifest)
+    return manifest
+
+
+def _write_shard(directory, label, part):
+    """写出一个分片(内容未变时文件保持不动), 返回清单中的条目"""
+    # 分片只带自己用到的类别, 新类别不会改变其他月份的分片
+    part = part.compact()
+    data = encode_binary(part)
+    digest = hashlib.sha256(data).hexdigest()
+    filename = f"{label}.{digest[:12]}.bin"
+    if not (directory / filename).exists():
+        (directory / filename).write_bytes(data)
+    time_range = part.time_bounds()
+    return {
+        'key': label,
+        'file': filename,
+        'rows': len(part),
+        'bytes': len(data),
+        'time_min': time_range[0] if time_range else None,
+        'time_max': time_range[1] if time_range else None,
+        'sha256': digest,
+    }
+
+
+def _write_manifest(directory, manifest):
+    """写出清单, 并删除不再被清单引用的旧分片"""
+    with open(directory / MANIFEST_FILE, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    current = {shard['file'] for shard in manifest['shards']}
+    for stale in directory.glob('*.bin'):
+        if stale.name not in current:
+            stale.unlink()
+
+
+def append_shards(delta, directory=SHARD_DIR, version=0, existing_rows=None):
+    """增量更新分片: 只读取并重写新记录所在的分片, 其余分片和文件名不变
+
+    清单缺失、无法读取或行数与existing_rows不一致时返回None, 由调用方全量重写。
+    """
+    directory = Path(directory)
+    try:
+        with open(directory / MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if existing_rows is not None and manifest.get('rows') != existing_rows:
+        return None
+
+    shards = {shard['key']: shard for shard in manifest['shards']}
+    keys = partition_keys(delta.times['处警时间'], manifest.get('period', 'month')).astype(str)
+    for label in np.unique(keys):
+        label = str(label)
+        part = delta.take(keys == label)
+        if label in shards:
+            try:
+                _, existing = decode_binary((directory / shards[label]['file']).read_bytes())
+            except (OSError, ValueError):
+                return None
+            part = IncidentTable.concat([existing, part])
+        shards[label] = _write_shard(directory, label, part)
+
+    manifest.update({
+        'version': version,
+        'rows': manifest['rows'] + len(delta),
+        'categories': sorted(set(manifest['categories']) | set(delta.categories)),
+        'shards': [shards[key] for key in sorted(shards)],
+    })
+    _write_manifest(directory, manifest)
+    return manifest
@@ -0,0 +1,90 @@
+"""
+服务器端网格聚合
+
+缩小地图时客户端不需要逐条案件: 把筛选后的点按Web墨卡托投影分箱到视野范围内的像素网格
+(每格cell_pixels个屏幕像素), 用一次np.bincount统计每格的案件数和坐标和,
+只返回非空格子的质心(格内案件的平均坐标)和计数, 数据量与格子数相关而与案件数无关。
+index.html把质心作为带权重的热力点交给L.heatLayer。
+"""
+
+import numpy as np
+
+from heat_tiles import mercator_pixels
+
+GRID_FORMAT = 'grid-v1'
+# 每个格子在屏幕上的像素数, 远小于热力图核半径(25像素), 聚合后热力图看不出差别
+GRID_CELL_PIXELS = 8
+MIN_CELL_PIXELS = 2
+# 单次聚合的格子数上限, 超出时格子边长加倍
+MAX_GRID_CELLS = 512 * 512
+
+
+def grid_shape(bbox, zoom, cell_pixels=GRID_CELL_PIXELS):
+    """bbox在zoom级别下的网格, 返回 (左上角像素x, 左上角像素y, 格子像素数, 列数, 行数)"""
+    west, south, east, north = bbox
+    (x0, x1), (y0, y1) = mercator_pixels([west, east], [north, south], zoom)
+    cell = max(float(cell_pixels), MIN_CELL_PIXELS)
+    while True:
+        # 向下取整再加一, bbox东、南边界上的点也落在网格内
+        nx = int((x1 - x0) // cell) + 1
+        ny = int((y1 - y0) // cell) + 1
+        if nx * ny <= MAX_GRID_CELLS:
+            return float(x0), float(y0), cell, nx, ny
+        cell *= 2
+
+
+def aggregate(lng, lat, bbox, zoom, cell_pixels=GRID_CELL_PIXELS, weights=None):
+    """二维直方图: 返回 (网格, 非空格子编号, 计数, 权重和, 质心经度, 质心纬度)
+
+    网格为grid_shape的结果; 格子编号为 行 * 列数 + 列; 没有weights时权重和等于计数。
+    """
+    x0, y0, cell, nx, ny = shape = grid_shape(bbox, zoom, cell_pixels)
+    lng = np.asarray(lng, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    x, y = mercator_pixels(lng, lat, zoom)
+    col = np.floor((x - x0) / cell).astype(np.int64)
+    row = np.floor((y - y0) / cell).astype(np.int64)
+    inside = (col >= 0) & (col < nx) & (row >= 0) & (row < ny)
+    flat = row[inside] * nx + col[inside]
+
+    size = nx * ny
+    counts = np.bincount(flat, minlength=size)
+    cells = np.flatnonzero(counts)
+    counts = counts[cells]
+    sum_lng = np.bincount(flat, weights=lng[inside], minlength=size)[cells]
+    sum_lat = np.bincount(flat, weights=lat[inside], minlength=size)[cells]
+    if weights is None:
+        totals = counts.astype(np.float64)
+    else:
+        weights = np.asarray(weights, dtype=np.float64)[inside]
+        totals = np.bincount(flat, weights=weights, minlength=size)[cells]
+    return shape, cells, counts, totals, sum_lng / counts, sum_lat / counts
+
+
+def grid_payload(table, rows, bbox, zoom, cell_pixels=GRID_CELL_PIXELS, version=0):
+    """bbox内的筛选结果rows(已按bbox筛选)的聚合网格, 可直接序列化为JSON
+
+    lat/lng/count 为非空格子的质心和案件数(三个等长数组);
+    visible为bbox内的案件数, categories为其中的类别数, extent为其经纬度范围 [西, 南, 东, 北]。
+    """
+    lng, lat = table.lng[rows], table.lat[rows]
+    (_, _, cell, nx, ny), cells, counts, _, c_lng, c_lat = aggregate(lng, lat, bbox, zoom, cell_pixels)
+    codes = table.codes[rows]
+    extent = None
+    if len(rows):
+        extent = [float(lng.min()), float(lat.min()), float(lng.max()), float(lat.max())]
+    return {
+        'format': GRID_FORMAT,
+        'version': version,
+        'zoom': zoom,
+        'cell': cell,
+        'bbox': list(bbox),
+        'nx': nx,
+        'ny': ny,
+        'visible': int(counts.sum()),
+        'categories': int(len(np.unique(codes[codes >= 0]))),
+        'extent': extent,
+        'lat': np.round(c_lat, 6).tolist(),
+        'lng': np.round(c_lng, 6).tolist(),
+        'count': counts.tolist(),
+    }
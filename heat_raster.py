@@ -0,0 +1,175 @@
+"""
+服务器端热力瓦片渲染
+
+为低端手机在服务器上绘制热力图: 把瓦片范围(含核半径的边距)内的点分箱到像素网格,
+用可分离高斯核平滑, 按index.html中showHeatmap的渐变(绿→黄→橙→红)着色后编码为PNG。
+渲染结果按 数据集版本 + 筛选条件 + z/x/y 缓存在磁盘上, 超出容量时按最近最少使用淘汰。
+容量按进程计算: 多进程模式下各进程共用缓存目录, mobile_server.py把总容量平分给各工作进程。
+"""
+
+import hashlib
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from heat_tiles import TILE_SIZE, mercator_pixels
+
+# 核半径(像素), 与index.html中热力图的radius一致
+KERNEL_RADIUS = 25
+KERNEL_SIGMA = KERNEL_RADIUS / 2.5
+# 单个格子达到几个点的密度时颜色饱和
+SATURATION_POINTS = 3.0
+# 低于该强度的像素完全透明
+MIN_INTENSITY = 0.05
+
+# index.html中showHeatmap的渐变
+GRADIENT = ((0.4, (0x00, 0xff, 0x00)), (0.6, (0xff, 0xff, 0x00)),
+            (0.8, (0xff, 0x80, 0x00)), (1.0, (0xff, 0x00, 0x00)))
+
+DEFAULT_CACHE_DIR = Path(__file__).resolve().parent / '.heatmap_cache' / 'raster'
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+
+
+def _build_palette():
+    """256级调色板: 颜色按渐变插值, 透明度等于强度"""
+    levels = np.linspace(0, 1, 256)
+    stops = np.array([s for s, _ in GRADIENT])
+    colors = np.array([c for _, c in GRADIENT], dtype=np.float64)
+    palette = np.empty((256, 4), dtype=np.uint8)
+    for channel in range(3):
+        palette[:, channel] = np.round(np.interp(levels, stops, colors[:, channel]))
+    palette[:, 3] = np.round(levels * 255)
+    palette[levels < MIN_INTENSITY, 3] = 0
+    return palette
+
+
+PALETTE = _build_palette()
+
+
+def _kernel_matrix(size, margin):
+    """一维高斯核的卷积矩阵, 把 size + 2*margin 的网格平滑并裁剪为 size"""
+    offsets = np.arange(-margin, margin + 1)
+    kernel = np.exp(-offsets ** 2 / (2 * KERNEL_SIGMA ** 2))
+    matrix = np.zeros((size, size + 2 * margin))
+    for i in range(size):
+        matrix[i, i:i + 2 * margin + 1] = kernel
+    return matrix
+
+
+_MARGIN = int(np.ceil(3 * KERNEL_SIGMA))
+_KERNEL = _kernel_matrix(TILE_SIZE, _MARGIN)
+# 单个点在核中心处的平滑值, 用于全局统一的强度归一化(不同瓦片之间不会出现接缝)
+_PEAK = 1.0
+
+
+def tile_bounds(z, x, y):
+    """瓦片加上平滑边距后的经纬度范围 (西, 南, 东, 北); 范围以外的点不影响该瓦片"""
+    world = TILE_SIZE * 2.0 ** z
+    px = (np.array([x, x + 1]) * TILE_SIZE + np.array([-_MARGIN, _MARGIN])) / world
+    py = (np.array([y + 1, y]) * TILE_SIZE + np.array([_MARGIN, -_MARGIN])) / world
+    lng = px * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * np.clip(py, 0, 1)))))
+    return float(lng[0]), float(lat[0]), float(lng[1]), float(lat[1])
+
+
+def density(lng, lat, z, x, y):
+    """瓦片范围内的平滑点密度, 形状为 (TILE_SIZE, TILE_SIZE), 行对应y"""
+    px, py = mercator_pixels(lng, lat, z)
+    px = px - x * TILE_SIZE + _MARGIN
+    py = py - y * TILE_SIZE + _MARGIN
+    extent = TILE_SIZE + 2 * _MARGIN
+    inside = (px >= 0) & (px < extent) & (py >= 0) & (py < extent)
+    counts = np.zeros((extent, extent))
+    if inside.any():
+        flat = py[inside].astype(np.int64) * extent + px[inside].astype(np.int64)
+        counts = np.bincount(flat, minlength=extent * extent).reshape(extent, extent).astype(np.float64)
+    # 可分离卷积: K @ H @ K^T
+    return _KERNEL @ counts @ _KERNEL.T
+
+
+def colorize(values):
+    """密度 -> RGBA图像"""
+    intensity = np.clip(values / (_PEAK * SATURATION_POINTS), 0, 1)
+    return PALETTE[np.round(intensity * 255).astype(np.uint8)]
+
+
+def encode_png(rgba):
+    """把 (高, 宽, 4) 的uint8数组编码为PNG"""
+    height, width, _ = rgba.shape
+    # 每行前加过滤类型0
+    raw = np.concatenate([np.zeros((height, 1), dtype=np.uint8),
+                          rgba.reshape(height, width * 4)], axis=1).tobytes()
+
+    def chunk(tag, data):
+        return (struct.pack('>I', len(data)) + tag + data
+                + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff))
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, 6))
+            + chunk(b'IEND', b''))
+
+
+def render_tile(lng, lat, z, x, y):
+    """渲染一个热力瓦片为PNG字节"""
+    return encode_png(colorize(density(lng, lat, z, x, y)))
+
+
+class TileCache:
+    """磁盘瓦片缓存, 超过容量时按最近最少使用淘汰"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._total = 0
+        # 启动时按修改时间恢复LRU顺序
+        if self.cache_dir.exists():
+            files = sorted(self.cache_dir.glob('*.png'), key=lambda p: p.stat().st_mtime)
+            for path in files:
+                size = path.stat().st_size
+                self._entries[path.stem] = size
+                self._total += size
+
+    @staticmethod
+    def make_key(version, filter_key, z, x, y):
+        text = f"{version}|{filter_key}|{z}/{x}/{y}"
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        path = self.cache_dir / f"{key}.png"
+        try:
+            data = path.read_bytes()
+            # 更新修改时间, 重启后仍能恢复LRU顺序
+            os.utime(path)
+            return data
+        except OSError:
+            with self._lock:
+                self._total -= self._entries.pop(key, 0)
+            return None
+
+    def put(self, key, data):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.cache_dir / f".{key}.{os.getpid()}.{threading.get_ident()}.tmp"
+        tmp.write_bytes(data)
+        os.replace(tmp, self.cache_dir / f"{key}.png")
+        with self._lock:
+            self._total += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                old, size = self._entries.popitem(last=False)
+                self._total -= size
+                try:
+                    (self.cache_dir / f"{old}.png").unlink()
+                except OSError:
+                    pass
@@ -0,0 +1,176 @@
+"""
+预计算热力瓦片金字塔
+
+在最大缩放级别把案件点按Web墨卡托投影分箱(每个256像素瓦片划分为GRID x GRID个格子),
+较低缩放级别由高一级的格子坐标右移合并求和得到, 各缩放级别在进程池中并行写出。
+瓦片为静态文件 tiles/{图层}/{z}/{x}/{y}.json, 内容为 {"cells": [[列, 行, 案件数], ...]}。
+
+图层:
+    all             全部案件
+    c{编码}          单个案件类别(编码见tiles/index.json的categories)
+    m{YYYY-MM}      单个月份
+    c{编码}-m{月份}   类别 x 月份(cross=True或--cross时生成)
+
+类别 x 月份图层默认不生成: 图层数为 类别数 x 月份数, 瓦片目录会成倍增大, 而index.html的预设时间窗口
+与月份分桶不对齐, 有时间筛选时使用原始点绘制, 不会请求这些图层(m{月份}图层同理, 留给按月查看的页面)。
+
+用法:
+    python heat_tiles.py [最小缩放] [最大缩放] [--cross]
+"""
+
+import json
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from export import partition_keys
+
+TILE_DIR = 'tiles'
+INDEX_FILE = 'index.json'
+TILE_SIZE = 256
+# 每个瓦片每个方向的格子数, 64即每格4像素
+GRID = 64
+# 与index.html中地图的缩放范围一致
+DEFAULT_MIN_ZOOM = 10
+DEFAULT_MAX_ZOOM = 16
+
+# 格子坐标打包为int64: 高32位为列, 低32位为行
+_ROW_MASK = (1 << 32) - 1
+
+
+def mercator_pixels(lng, lat, zoom):
+    """经纬度 -> 指定缩放级别下的全局像素坐标(Web墨卡托)"""
+    world = TILE_SIZE * 2.0 ** zoom
+    x = (np.asarray(lng, dtype=np.float64) + 180.0) / 360.0 * world
+    sin_lat = np.clip(np.sin(np.radians(lat)), -0.9999, 0.9999)
+    y = (0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * np.pi)) * world
+    return x, y
+
+
+def cell_histogram(lng, lat, zoom):
+    """最大缩放级别的稀疏格子直方图, 返回 (格子键, 计数)"""
+    x, y = mercator_pixels(lng, lat, zoom)
+    cell_size = TILE_SIZE / GRID
+    cx = np.floor(x / cell_size).astype(np.int64)
+    cy = np.floor(y / cell_size).astype(np.int64)
+    keys, counts = np.unique((cx << 32) | cy, return_counts=True)
+    return keys, counts.astype(np.int64)
+
+
+def downsample(keys, counts, levels):
+    """把格子直方图降低levels个缩放级别: 每级2x2个格子合并求和"""
+    if levels == 0:
+        return keys, counts
+    cx = (keys >> 32) >> levels
+    cy = (keys & _ROW_MASK) >> levels
+    merged, inverse = np.unique((cx << 32) | cy, return_inverse=True)
+    return merged, np.bincount(inverse, weights=counts).astype(np.int64)
+
+
+def _write_zoom(histograms, zoom, max_zoom, out_dir):
+    """进程池任务: 写出一个缩放级别下所有图层的瓦片, 返回各图层统计"""
+    stats = {}
+    for layer, (keys, counts) in histograms.items():
+        keys, counts = downsample(keys, counts, max_zoom - zoom)
+        cx = keys >> 32
+        cy = keys & _ROW_MASK
+        tx, ty = cx // GRID, cy // GRID
+        tile_keys = (tx << 32) | ty
+        order = np.argsort(tile_keys, kind='stable')
+        tiles, starts = np.unique(tile_keys[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        for tile, start, end in zip(tiles, starts, ends):
+            idx = order[start:end]
+            x, y = int(tile >> 32), int(tile & _ROW_MASK)
+            cells = np.column_stack([cx[idx] % GRID, cy[idx] % GRID, counts[idx]]).tolist()
+            path = Path(out_dir) / layer / str(zoom) / str(x)
+            path.mkdir(parents=True, exist_ok=True)
+            with open(path / f"{y}.json", 'w', encoding='utf-8') as f:
+                json.dump({'cells': cells}, f, separators=(',', ':'))
+        stats[layer] = {
+            'max': int(counts.max()) if len(counts) else 0,
+            'tiles': len(tiles),
+            # 瓦片坐标范围 [最小x, 最小y, 最大x, 最大y], 前端据此跳过无数据的瓦片
+            'bounds': [int((tiles >> 32).min()), int((tiles & _ROW_MASK).min()),
+                       int((tiles >> 32).max()), int((tiles & _ROW_MASK).max())] if len(tiles) else None,
+        }
+    return zoom, stats
+
+
+def layer_masks(table, period='month', cross=False):
+    """各图层对应的行掩码"""
+    masks = {'all': np.ones(len(table), dtype=bool)}
+    for code in range(len(table.categories)):
+        masks[f'c{code}'] = table.codes == code
+    periods = partition_keys(table.times['处警时间'], period).astype(str)
+    for key in np.unique(periods):
+        if key == 'undated':
+            continue
+        masks[f'm{key}'] = periods == key
+        if cross:
+            for code in range(len(table.categories)):
+                mask = (periods == key) & (table.codes == code)
+                if mask.any():
+                    masks[f'c{code}-m{key}'] = mask
+    return masks
+
+
+def generate_pyramid(table, out_dir=TILE_DIR, min_zoom=DEFAULT_MIN_ZOOM, max_zoom=DEFAULT_MAX_ZOOM,
+                     period='month', cross=False, version=0, workers=None, verbose=True):
+    """生成瓦片金字塔和索引文件"""
+    start = time.perf_counter()
+    out_dir = Path(out_dir)
+    # 整体重建, 避免残留旧数据的瓦片
+    shutil.rmtree(out_dir, ignore_errors=True)
+    out_dir.mkdir(parents=True)
+
+    masks = layer_masks(table, period, cross)
+    histograms = {layer: cell_histogram(table.lng[mask], table.lat[mask], max_zoom)
+                  for layer, mask in masks.items()}
+
+    zooms = range(min_zoom, max_zoom + 1)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_write_zoom, histograms, z, max_zoom, out_dir) for z in zooms]
+        results = dict(f.result() for f in futures)
+
+    layers = {}
+    for layer, (_, counts) in histograms.items():
+        mask = masks[layer]
+        layers[layer] = {
+            'rows': int(counts.sum()),
+            # 经纬度范围 [西, 南, 东, 北], 页面据此显示覆盖范围而不必下载逐条案件
+            'extent': [float(table.lng[mask].min()), float(table.lat[mask].min()),
+                       float(table.lng[mask].max()), float(table.lat[mask].max())] if mask.any() else None,
+            'zooms': {str(z): results[z][layer] for z in zooms},
+        }
+    index = {
+        'version': version,
+        'tile_size': TILE_SIZE,
+        'grid': GRID,
+        'min_zoom': min_zoom,
+        'max_zoom': max_zoom,
+        'period': period,
+        'categories': table.categories,
+        'layers': layers,
+    }
+    with open(out_dir / INDEX_FILE, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+
+    if verbose:
+        tile_count = sum(s['tiles'] for r in results.values() for s in r.values())
+        print(f"瓦片生成完成: {len(layers)} 个图层, 缩放 {min_zoom}-{max_zoom}, "
+              f"{tile_count} 个瓦片, 用时 {time.perf_counter() - start:.2f} 秒")
+    return index
+
+
+if __name__ == '__main__':
+    from ingest import load_dataset, load_dataset_meta
+
+    zoom_range = [int(v) for v in sys.argv[1:] if v != '--cross'][:2]
+    generate_pyramid(load_dataset(), min_zoom=zoom_range[0] if zoom_range else DEFAULT_MIN_ZOOM,
+                     max_zoom=zoom_range[1] if len(zoom_range) > 1 else DEFAULT_MAX_ZOOM,
+                     cross='--cross' in sys.argv[1:], version=load_dataset_meta().get('version', 0))
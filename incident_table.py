@@ -0,0 +1,265 @@
+"""
+案件数据的列式存储结构
+
+经纬度保存为float64数组, 时间列保存为int64秒级时间戳(按墙上时间解释, 不做时区换算),
+案件类别做字典编码, 所有派生量(类别集合、时间范围、中心点)都以向量化方式计算。
+"""
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# 时间戳缺失值, 与numpy的NaT整数表示一致
+NAT = np.iinfo(np.int64).min
+
+TIME_COLUMNS = ('处警时间', '案发时间下限', '案发时间上限')
+# 列顺序与data.json保持一致
+COLUMNS = ('处警时间', '经度', '纬度', '案发时间下限', '案发时间上限', '案件类别')
+
+# 列匹配或清洗规则变化时递增, 派生数据(缓存等)据此失效
+CLEANING_VERSION = 2
+
+
+def match_columns(columns, required=('经度', '纬度')):
+    """智能匹配列名, 返回 {标准列名: 原始列名}"""
+    mapping = {}
+    used = set()
+
+    def assign(name, col):
+        if name not in mapping and col not in used:
+            mapping[name] = col
+            used.add(col)
+
+    # 优先精确匹配
+    for col in columns:
+        if str(col) in COLUMNS:
+            assign(str(col), col)
+
+    # 关键字匹配
+    for col in columns:
+        col_text = str(col)
+        col_str = col_text.lower()
+        if '经度' in col_text or 'lng' in col_str or 'lon' in col_str:
+            assign('经度', col)
+        elif '纬度' in col_text or 'lat' in col_str:
+            assign('纬度', col)
+        elif '类别' in col_text or 'type' in col_str or 'category' in col_str:
+            assign('案件类别', col)
+        elif '下限' in col_text:
+            assign('案发时间下限', col)
+        elif '上限' in col_text:
+            assign('案发时间上限', col)
+        elif '处警' in col_text:
+            assign('处警时间', col)
+
+    # 没有处警时间时退而使用第一个时间列
+    for col in columns:
+        col_text = str(col)
+        col_str = col_text.lower()
+        if '时间' in col_text or 'date' in col_str or 'time' in col_str:
+            assign('处警时间', col)
+
+    missing_cols = [name for name in required if name not in mapping]
+    if missing_cols:
+        raise ValueError(f"Excel文件缺少必要列: {', '.join(missing_cols)}")
+    return mapping
+
+
+# 常见时间格式, 按样本检测后整列按固定格式解析
+DATETIME_FORMATS = (
+    '%Y-%m-%d %H:%M:%S',
+    '%Y/%m/%d %H:%M:%S',
+    '%Y-%m-%d %H:%M',
+    '%Y/%m/%d %H:%M',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y%m%d%H%M%S',
+    '%Y-%m-%d',
+    '%Y/%m/%d',
+)
+
+
+def detect_datetime_format(texts, sample_size=200):
+    """从非空样本中检测时间格式, 样本全部符合的第一个格式胜出; 检测不到返回None"""
+    sample = [text for text in texts[:sample_size] if text]
+    if not sample:
+        return None
+    for fmt in DATETIME_FORMATS:
+        try:
+            for text in sample:
+                datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+        return fmt
+    return None
+
+
+def to_epoch(values):
+    """将时间列转换为int64秒级时间戳, 无法解析的值为NAT
+
+    字符串列先按样本检测出的固定格式整列解析, 只有解析失败的行才回退到逐行推断。
+    """
+    series = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(series.dtype) or pd.api.types.is_numeric_dtype(series.dtype):
+        parsed = pd.to_datetime(series, errors='coerce')
+    else:
+        sample = series.head(1000).dropna()
+        fmt = detect_datetime_format([str(v).strip() for v in sample])
+        if fmt is None:
+            parsed = pd.to_datetime(series, errors='coerce', format='mixed')
+        else:
+            parsed = pd.to_datetime(series, errors='coerce', format=fmt)
+            # 只对固定格式解析失败的行回退到逐行推断
+            failed = parsed.isna() & series.notna()
+            if failed.any():
+                retry = series[failed].astype('string').str.strip()
+                parsed[failed] = pd.to_datetime(retry, errors='coerce', format='mixed')
+    return parsed.to_numpy(dtype='datetime64[s]').astype(np.int64)
+
+
+def format_epoch(seconds):
+    """将秒级时间戳批量格式化为 'YYYY-MM-DD HH:MM:SS', 缺失值为None"""
+    seconds = np.asarray(seconds, dtype=np.int64)
+    text = np.datetime_as_string(seconds.astype('datetime64[s]'), unit='s')
+    text = np.char.replace(text, 'T', ' ').astype(object)
+    text[seconds == NAT] = None
+    return text
+
+
+class IncidentTable:
+    """列式案件数据表"""
+
+    def __init__(self, lng, lat, times, codes, categories):
+        self.lng = np.asarray(lng, dtype=np.float64)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.times = {name: np.asarray(times.get(name, np.full(len(self.lng), NAT)), dtype=np.int64)
+                      for name in TIME_COLUMNS}
+        # 类别编码, -1表示缺失
+        self.codes = np.asarray(codes, dtype=np.int32)
+        self.categories = list(categories)
+
+    def __len__(self):
+        return len(self.lng)
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0), np.empty(0), {}, np.empty(0, dtype=np.int32), [])
+
+    @classmethod
+    def from_dataframe(cls, df, required=('经度', '纬度')):
+        """从DataFrame构建, 自动匹配列名并清洗无效行"""
+        mapping = match_columns(df.columns, required)
+
+        lng = pd.to_numeric(df[mapping['经度']], errors='coerce').to_numpy(dtype=np.float64)
+        lat = pd.to_numeric(df[mapping['纬度']], errors='coerce').to_numpy(dtype=np.float64)
+        valid = (np.abs(lat) <= 90) & (np.abs(lng) <= 180)
+
+        times = {}
+        for name in TIME_COLUMNS:
+            if name in mapping:
+                times[name] = to_epoch(df[mapping[name]])
+                if name in required:
+                    valid &= times[name] != NAT
+
+        if '案件类别' in mapping:
+            codes, uniques = pd.factorize(df[mapping['案件类别']], sort=True)
+            categories = [str(c) for c in uniques]
+            if '案件类别' in required:
+                valid &= codes >= 0
+        else:
+            codes = np.full(len(df), -1)
+            categories = []
+
+        table = cls(lng[valid], lat[valid], {k: v[valid] for k, v in times.items()},
+                    codes[valid], categories)
+        return table.compact()
+
+    @classmethod
+    def from_excel(cls, path, required=('经度', '纬度')):
+        """读取Excel文件并构建"""
+        return cls.from_dataframe(pd.read_excel(path), required)
+
+    @classmethod
+    def concat(cls, tables):
+        """合并多个表, 类别字典取并集并重新编码"""
+        tables = [t for t in tables if len(t)]
+        if not tables:
+            return cls.empty()
+        categories = sorted(set().union(*(t.categories for t in tables)))
+        lookup = {name: i for i, name in enumerate(categories)}
+        codes = []
+        for t in tables:
+            # 末尾追加-1, 使缺失编码映射回-1
+            remap = np.array([lookup[c] for c in t.categories] + [-1], dtype=np.int32)
+            codes.append(remap[t.codes])
+        return cls(
+            np.concatenate([t.lng for t in tables]),
+            np.concatenate([t.lat for t in tables]),
+            {name: np.concatenate([t.times[name] for t in tables]) for name in TIME_COLUMNS},
+            np.concatenate(codes),
+            categories,
+        )
+
+    def take(self, indices):
+        """按下标或布尔掩码取子集, 类别字典保持不变"""
+        return IncidentTable(self.lng[indices], self.lat[indices],
+                             {k: v[indices] for k, v in self.times.items()},
+                             self.codes[indices], self.categories)
+
+    def compact(self):
+        """去掉未使用的类别, 保持字典有序"""
+        used = np.unique(self.codes[self.codes >= 0])
+        if len(used) == len(self.categories):
+            return self
+        remap = np.full(len(self.categories) + 1, -1, dtype=np.int32)
+        remap[used] = np.arange(len(used), dtype=np.int32)
+        self.codes = remap[self.codes]
+        self.categories = [self.categories[i] for i in used]
+        return self
+
+    def category_labels(self):
+        """返回每行的类别名称数组"""
+        labels = np.array(self.categories + [None], dtype=object)
+        return labels[self.codes]
+
+    def category_counts(self):
+        """各类别案件数, 按数量降序"""
+        counts = np.bincount(self.codes[self.codes >= 0], minlength=len(self.categories))
+        order = np.argsort(-counts, kind='stable')
+        return {self.categories[i]: int(counts[i]) for i in order}
+
+    def time_bounds(self, name='处警时间'):
+        """返回时间列的(最小值, 最大值), 全部缺失时返回None"""
+        values = self.times[name]
+        values = values[values != NAT]
+        if not len(values):
+            return None
+        return int(values.min()), int(values.max())
+
+    def center(self):
+        """返回(平均纬度, 平均经度)"""
+        return float(self.lat.mean()), float(self.lng.mean())
+
+    def to_dataframe(self):
+        """转换为DataFrame, 时间列为datetime64"""
+        columns = {
+            '处警时间': self.times['处警时间'].astype('datetime64[s]'),
+            '经度': self.lng,
+            '纬度': self.lat,
+            '案发时间下限': self.times['案发时间下限'].astype('datetime64[s]'),
+            '案发时间上限': self.times['案发时间上限'].astype('datetime64[s]'),
+            '案件类别': self.category_labels(),
+        }
+        return pd.DataFrame(columns)
+
+    def to_records(self):
+        """转换为可JSON序列化的字典列表, 键顺序与data.json一致"""
+        columns = {
+            '处警时间': format_epoch(self.times['处警时间']).tolist(),
+            '经度': self.lng.tolist(),
+            '纬度': self.lat.tolist(),
+            '案发时间下限': format_epoch(self.times['案发时间下限']).tolist(),
+            '案发时间上限': format_epoch(self.times['案发时间上限']).tolist(),
+            '案件类别': self.category_labels().tolist(),
+        }
+        return [dict(zip(COLUMNS, row)) for row in zip(*(columns[name] for name in COLUMNS))]
@@ -0,0 +1,395 @@
+"""
+Excel数据导入
+
+流式读取: 通过openpyxl只读模式逐行迭代工作表, 列名匹配只对表头做一次,
+每个分块清洗后追加到列式存储, 峰值内存与分块大小成正比而不是与文件大小成正比。
+
+增量导入: 新工作簿按稳定记录键(坐标 + 处警时间 + 案件类别)与已有数据去重,
+只把新增记录追加到data.json末尾, 并递增data_meta.json中的数据集版本;
+全量重建时记录键摘要不变则保持原版本, 同一份源数据重复构建得到逐字节相同的输出文件;
+二维前缀和计数表(data_area.npz)和统计立方体(stats_cube.json)只累加新增记录,
+分片只重写新增记录所在的月份。data.v2.json和data.bin是按时间排序的单个文件, 仍整体重写。
+    python ingest.py append 新数据.xlsx
+
+多工作簿导入: 接受目录或通配符, 用进程池并行解析各派出所/各月份的工作簿,
+单个文件出错只记录在报告中, 不影响其余文件; 工作进程异常退出导致进程池损坏时,
+受影响的工作簿在报告中记为进程池失败, 并在主进程中逐个重试。
+"""
+
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from export import (BINARY_FILE, COMPACT_FILE, SHARD_DIR, append_shards, load_compact_json,
+                    write_binary, write_compact_json, write_shards)
+from incident_table import IncidentTable, match_columns
+from stats_cube import CUBE_FILE, StatsCube, write_stats_cube
+from summed_area import AREA_FILE, SummedAreaTable
+
+DEFAULT_CHUNK_SIZE = 50000
+# data.json的格式: 每个字段一行, 冒号后不加空格(与仓库中已有的data.json一致)
+DATA_SEPARATORS = (',', ':')
+
+# openpyxl只支持这些格式, 其他格式回退为整表读取
+STREAMABLE_SUFFIXES = ('.xlsx', '.xlsm')
+
+
+def iter_excel_rows(path, sheet=None):
+    """只读模式迭代工作表, 先返回表头, 再逐行返回数据"""
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet] if sheet else workbook.active
+        yield from worksheet.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def iter_excel_chunks(path, required=('经度', '纬度'), chunk_size=DEFAULT_CHUNK_SIZE, sheet=None):
+    """按分块读取Excel, 每块清洗为一个IncidentTable"""
+    rows = iter_excel_rows(path, sheet)
+    header = next(rows, None)
+    if header is None:
+        return
+
+    # 列名匹配只做一次, 之后按列下标取值
+    mapping = match_columns(header, required)
+    positions = {name: list(header).index(col) for name, col in mapping.items()}
+
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield _chunk_to_table(chunk, positions, required), len(chunk)
+            chunk = []
+    if chunk:
+        yield _chunk_to_table(chunk, positions, required), len(chunk)
+
+
+def _chunk_to_table(chunk, positions, required):
+    width = max(positions.values()) + 1
+    columns = {name: [] for name in positions}
+    for row in chunk:
+        # 只读模式下行可能短于表头
+        if len(row) < width:
+            row = tuple(row) + (None,) * (width - len(row))
+        for name, pos in positions.items():
+            columns[name].append(row[pos])
+    return IncidentTable.from_dataframe(pd.DataFrame(columns), required)
+
+
+def load_excel_streaming(path, required=('经度', '纬度'), chunk_size=DEFAULT_CHUNK_SIZE,
+                         sheet=None, verbose=True):
+    """流式加载Excel为IncidentTable, 并输出进度与吞吐"""
+    path = Path(path)
+    if path.suffix.lower() not in STREAMABLE_SUFFIXES:
+        if verbose:
+            print(f"{path.suffix} 格式不支持流式读取，改为整表读取")
+        return IncidentTable.from_excel(path, required)
+
+    tables = []
+    total_rows = 0
+    start = time.perf_counter()
+    for table, row_count in iter_excel_chunks(path, required, chunk_size, sheet):
+        tables.append(table)
+        total_rows += row_count
+        if verbose:
+            elapsed = time.perf_counter() - start
+            rate = total_rows / elapsed if elapsed > 0 else 0
+            print(f"已读取 {total_rows} 行 ({rate:.0f} 行/秒)")
+
+    result = IncidentTable.concat(tables)
+    if verbose:
+        elapsed = time.perf_counter() - start
+        print(f"读取完成: {total_rows} 行, 有效 {len(result)} 条, 用时 {elapsed:.2f} 秒")
+    return result
+
+
+# 数据集文件及其附属文件: 版本信息与记录键索引
+DATA_FILE = 'data.json'
+META_FILE = 'data_meta.json'
+KEYS_FILE = 'data_keys.npy'
+
+# 记录键中坐标的量化精度(度), 约1米
+KEY_PRECISION = 1e-5
+
+
+def record_keys(table):
+    """稳定记录键: 坐标 + 处警时间 + 案件类别, 哈希为uint64"""
+    frame = pd.DataFrame({
+        'lng': np.round(table.lng / KEY_PRECISION).astype(np.int64),
+        'lat': np.round(table.lat / KEY_PRECISION).astype(np.int64),
+        'time': table.times['处警时间'],
+        'category': table.category_labels(),
+    })
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy(dtype=np.uint64)
+
+
+def load_dataset_meta(directory='.'):
+    """读取数据集版本信息, 不存在时返回初始值"""
+    try:
+        with open(Path(directory) / META_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'version': 0, 'rows': 0}
+
+
+def keys_digest(keys):
+    """记录键数组的摘要, 用于判断数据集内容是否变化"""
+    return hashlib.sha1(np.ascontiguousarray(keys, dtype=np.uint64).tobytes()).hexdigest()[:16]
+
+
+def _save_dataset_meta(directory, table_rows, time_bounds, meta, digest):
+    meta = dict(meta)
+    # 内容与上次写出时相同则不递增版本
+    if meta.get('digest') != digest:
+        meta['version'] = meta.get('version', 0) + 1
+    meta['digest'] = digest
+    meta['rows'] = table_rows
+    meta['updated'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    if time_bounds:
+        meta['time_min'], meta['time_max'] = time_bounds
+    with open(Path(directory) / META_FILE, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return meta
+
+
+def load_dataset(directory='.'):
+    """从data.json读取完整数据集"""
+    with open(Path(directory) / DATA_FILE, 'r', encoding='utf-8') as f:
+        records = json.load(f)
+    if not records:
+        return IncidentTable.empty()
+    return IncidentTable.from_dataframe(pd.DataFrame(records))
+
+
+def write_dataset(table, directory='.'):
+    """全量写出data.json, 同时重建记录键索引; 数据内容有变化时递增数据集版本"""
+    directory = Path(directory)
+    with open(directory / DATA_FILE, 'w', encoding='utf-8') as f:
+        json.dump(table.to_records(), f, ensure_ascii=False, indent=2, separators=DATA_SEPARATORS)
+    keys = record_keys(table)
+    np.save(directory / KEYS_FILE, keys)
+    SummedAreaTable.build(table).save(directory / AREA_FILE)
+    meta = _save_dataset_meta(directory, len(table), table.time_bounds(), load_dataset_meta(directory),
+                              keys_digest(keys))
+    update_derived(table, directory, meta)
+    return meta
+
+
+def update_derived(table, directory, meta):
+    """根据完整数据集重新生成派生的前端数据文件"""
+    write_compact_json(table, Path(directory) / COMPACT_FILE, meta['version'])
+    write_binary(table, Path(directory) / BINARY_FILE, meta['version'])
+    write_shards(table, Path(directory) / SHARD_DIR, version=meta['version'])
+    write_stats_cube(table, Path(directory) / CUBE_FILE, meta['version'])
+
+
+def _load_full_dataset(directory, delta):
+    """已有数据(优先读取紧凑格式) + 新增记录"""
+    compact_path = Path(directory) / COMPACT_FILE
+    if compact_path.exists():
+        return IncidentTable.concat([load_compact_json(compact_path), delta])
+    return load_dataset(directory)
+
+
+def _append_json_records(path, records):
+    """在JSON数组末尾原地追加记录, 不重写已有内容"""
+    body = json.dumps(records, ensure_ascii=False, indent=2, separators=DATA_SEPARATORS)[1:-1].strip('\n')
+    with open(path, 'r+b') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        tail_size = min(size, 4096)
+        f.seek(size - tail_size)
+        tail = f.read(tail_size)
+        end = tail.rfind(b']')
+        if end < 0:
+            raise ValueError(f"{path} 不是JSON数组")
+        # 数组为空时不需要逗号
+        empty = tail[:end].rstrip().endswith(b'[')
+        f.seek(size - tail_size + end)
+        f.write(((('\n' if empty else ',\n') + body + '\n]\n').encode('utf-8')))
+        f.truncate()
+
+
+def _append_summed_area(directory, delta, existing_rows):
+    """前缀和计数表累加新增记录; 表缺失或与已有数据行数不一致时返回False"""
+    path = Path(directory) / AREA_FILE
+    try:
+        area = SummedAreaTable.load(path)
+    except (OSError, ValueError, KeyError):
+        return False
+    if area.rows != existing_rows:
+        return False
+    area.append(delta).save(path)
+    return True
+
+
+def _append_stats_cube(directory, delta, existing_rows, version):
+    """统计立方体累加新增记录; 文件缺失或与已有数据行数不一致时返回False"""
+    path = Path(directory) / CUBE_FILE
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            payload = json.load(f)
+        cube = StatsCube.from_payload(payload)
+    except (OSError, ValueError, KeyError):
+        return False
+    if payload.get('rows') != existing_rows:
+        return False
+    cube.append(delta).save(path, version)
+    return True
+
+
+def append_derived(full, delta, directory, meta, existing_rows):
+    """增量更新派生文件: 分片只重写新增记录所在的月份, 计数表和立方体只累加新增记录;
+    data.v2.json和data.bin按时间排序并差分编码, 只能整体重写"""
+    directory = Path(directory)
+    version = meta['version']
+    write_compact_json(full, directory / COMPACT_FILE, version)
+    write_binary(full, directory / BINARY_FILE, version)
+    if append_shards(delta, directory / SHARD_DIR, version, existing_rows) is None:
+        write_shards(full, directory / SHARD_DIR, version=version)
+    if not _append_stats_cube(directory, delta, existing_rows, version):
+        write_stats_cube(full, directory / CUBE_FILE, version)
+    if not _append_summed_area(directory, delta, existing_rows):
+        SummedAreaTable.build(full).save(directory / AREA_FILE)
+
+
+def append_incremental(excel_path, directory='.', required=('经度', '纬度'), chunk_size=None):
+    """增量导入: 只读取新工作簿, 按记录键去重后追加到data.json并递增版本"""
+    directory = Path(directory)
+    data_path = directory / DATA_FILE
+    if not data_path.exists():
+        table = load_excel_streaming(excel_path, required, chunk_size) if chunk_size \
+            else IncidentTable.from_excel(excel_path, required)
+        meta = write_dataset(table, directory)
+        print(f"已创建数据集: {len(table)} 条, 版本 {meta['version']}")
+        return table
+
+    # 记录键索引缺失时从已有数据重建一次
+    keys_path = directory / KEYS_FILE
+    if keys_path.exists():
+        existing_keys = np.load(keys_path)
+    else:
+        existing_keys = record_keys(load_dataset(directory))
+
+    incoming = load_excel_streaming(excel_path, required, chunk_size) if chunk_size \
+        else IncidentTable.from_excel(excel_path, required)
+    keys = record_keys(incoming)
+    # 去掉已存在的记录以及新数据内部的重复
+    fresh = ~np.isin(keys, existing_keys)
+    fresh &= ~pd.Series(keys).duplicated().to_numpy()
+    delta = incoming.take(fresh).compact()
+
+    meta = load_dataset_meta(directory)
+    if not len(delta):
+        print(f"没有新记录, 数据集保持版本 {meta.get('version', 0)}")
+        return delta
+
+    _append_json_records(data_path, delta.to_records())
+    all_keys = np.concatenate([existing_keys, keys[fresh]])
+    np.save(keys_path, all_keys)
+    bounds = delta.time_bounds()
+    if bounds and 'time_min' in meta:
+        bounds = (min(bounds[0], meta['time_min']), max(bounds[1], meta['time_max']))
+    meta = _save_dataset_meta(directory, len(all_keys), bounds, meta, keys_digest(all_keys))
+    append_derived(_load_full_dataset(directory, delta), delta, directory, meta, len(existing_keys))
+    print(f"新增 {len(delta)} 条记录 (跳过重复 {len(incoming) - len(delta)} 条), 数据集版本 {meta['version']}")
+    return delta
+
+
+def find_sources(source):
+    """把目录、通配符或文件列表展开为工作簿路径列表"""
+    if isinstance(source, (list, tuple)):
+        paths = [Path(p) for p in source]
+    elif glob.has_magic(str(source)):
+        paths = [Path(p) for p in glob.glob(str(source), recursive=True)]
+    elif Path(source).is_dir():
+        paths = [p for p in Path(source).iterdir() if p.suffix.lower() in ('.xlsx', '.xlsm', '.xls')]
+    else:
+        paths = [Path(source)]
+    # 跳过Excel打开文件时产生的临时锁文件
+    return sorted(p for p in paths if not p.name.startswith('~$'))
+
+
+def _load_source(path, required, chunk_size, use_cache):
+    """进程池任务: 解析单个工作簿, 异常作为结果返回"""
+    start = time.perf_counter()
+    try:
+        if use_cache:
+            from data_cache import load_excel_cached
+            table = load_excel_cached(path, required, chunk_size, verbose=False)
+        elif chunk_size:
+            table = load_excel_streaming(path, required, chunk_size, verbose=False)
+        else:
+            table = IncidentTable.from_excel(path, required)
+        # 内存映射的缓存数组不能跨进程传递, 转为普通数组
+        table = IncidentTable(np.array(table.lng), np.array(table.lat),
+                              {k: np.array(v) for k, v in table.times.items()},
+                              np.array(table.codes), table.categories)
+        return path, table, time.perf_counter() - start, None
+    except Exception as e:
+        return path, None, time.perf_counter() - start, f"{type(e).__name__}: {e}"
+
+
+def load_excel_sources(source, required=('经度', '纬度'), workers=None, chunk_size=None,
+                       use_cache=True, verbose=True):
+    """并行加载多个工作簿并合并, 返回 (IncidentTable, 每个文件的报告)"""
+    paths = find_sources(source)
+    if not paths:
+        raise FileNotFoundError(f"未找到工作簿: {source}")
+
+    start = time.perf_counter()
+    pool_errors = {}
+    if len(paths) == 1 or workers == 1:
+        results = [_load_source(p, required, chunk_size, use_cache) for p in paths]
+    else:
+        results = []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_load_source, p, required, chunk_size, use_cache) for p in paths]
+            for path, future in zip(paths, futures):
+                try:
+                    results.append(future.result())
+                except BrokenProcessPool as e:
+                    pool_errors[path] = f"{type(e).__name__}: {e}"
+                    results.append(None)
+        # 工作进程异常退出(如内存不足被杀)时, 未完成的工作簿在主进程中逐个重试
+        results = [result or _load_source(path, required, chunk_size, use_cache)
+                   for path, result in zip(paths, results)]
+
+    report = []
+    tables = []
+    for path, table, elapsed, error in results:
+        report.append({'path': str(path), 'rows': len(table) if table is not None else 0,
+                       'seconds': elapsed, 'error': error, 'pool_error': pool_errors.get(path)})
+        if table is not None:
+            tables.append(table)
+        if verbose:
+            status = f"失败 {error}" if error else f"{len(table)} 条"
+            retried = f", 进程池失败后重试 ({pool_errors[path]})" if path in pool_errors else ""
+            print(f"  {path.name}: {status} ({elapsed:.2f} 秒){retried}")
+
+    result = IncidentTable.concat(tables)
+    if verbose:
+        failed = sum(1 for r in report if r['error'])
+        print(f"共 {len(paths)} 个工作簿, 失败 {failed} 个, 重试 {len(pool_errors)} 个, 合计 {len(result)} 条, "
+              f"用时 {time.perf_counter() - start:.2f} 秒")
+    return result, report
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 3 and sys.argv[1] == 'append':
+        for path in sys.argv[2:]:
+            append_incremental(path)
+    else:
+        print("用法: python ingest.py append 新数据.xlsx [...]")
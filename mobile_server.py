@@ -1,21 +1,52 @@
 import http.server
-import socketserver
 import os
+import re
 import webbrowser
 import ssl
 import socket
-from urllib.parse import urlparse
+import sys
+from urllib.parse import urlparse, parse_qs
 import json
+import gzip
+import hashlib
+
+import numpy as np
+
+from export import compact_payload, time_order
+from grid_aggregate import GRID_CELL_PIXELS, grid_payload
+from heat_raster import DEFAULT_CACHE_BYTES, TileCache, render_tile, tile_bounds
+from serving import KeepAliveMixin, PooledHTTPServer, PreforkSupervisor, ReusePortHTTPServer, serve_until_stopped
+from server_data import (MAX_ZOOM, category_codes, dataset, filter_indices, filter_key, filter_mask,
+                         finite_float, parse_filter)
+from static_assets import PrecompressedMixin, accepted_encodings, asset_cache, etag_matches, precompress
+
+# 服务器端渲染的热力瓦片: /tiles/{z}/{x}/{y}.png?category=...&days=...
+TILE_ROUTE = re.compile(r'^/tiles/(\d+)/(\d+)/(\d+)\.png$')
+# 数据查询接口: /api/data?category=...&days=...&bbox=西,南,东,北&zoom=...
+API_DATA_ROUTE = '/api/data'
+# 聚合网格接口: /api/grid?bbox=西,南,东,北&zoom=...&cell=像素 (筛选条件同/api/data), 返回非空格子的质心和案件数
+API_GRID_ROUTE = '/api/grid'
+# 区域计数: /api/count?bbox=西,南,东,北 (筛选条件同/api/data), 由二维前缀和表查表得到, 按格子和月份对齐
+API_COUNT_ROUTE = '/api/count'
+# 统计信息: /api/stats?category=...&days=...&top=N, 由内存中的统计立方体查表得到(时间按整点对齐)
+API_STATS_ROUTE = '/api/stats'
+STATS_DEFAULT_TOP = 10
+# 附近案件: /api/nearby?lat=...&lng=...&radius=米&k=个数 (可同时带category、days等筛选条件)
+API_NEARBY_ROUTE = '/api/nearby'
+NEARBY_DEFAULT_K = 20
+NEARBY_MAX_K = 500
+# 每个进程各有一份缓存索引和容量; 多进程模式下start_prefork_server把总容量平分给各工作进程
+tile_cache = TileCache()
+
+class MobileHTTPRequestHandler(KeepAliveMixin, PrecompressedMixin, http.server.SimpleHTTPRequestHandler):
+    # 静态资源按类别设置缓存策略(见static_assets.cache_policy), 其余响应每次重新验证
+    default_cache_control = 'no-cache'
 
-class MobileHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
     def end_headers(self):
         # 添加移动端优化的HTTP头
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
-        self.send_header('Pragma', 'no-cache')
-        self.send_header('Expires', '0')
         # 移动端优化
         self.send_header('X-Content-Type-Options', 'nosniff')
         self.send_header('X-Frame-Options', 'DENY')
@@ -24,7 +55,230 @@ class MobileHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
 
     def do_OPTIONS(self):
         self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        route = urlparse(self.path)
+        match = TILE_ROUTE.match(route.path)
+        if match:
+            self.send_heat_tile(*(int(v) for v in match.groups()), parse_qs(route.query))
+        elif route.path == API_DATA_ROUTE:
+            self.send_api_data(parse_qs(route.query))
+        elif route.path == API_GRID_ROUTE:
+            self.send_api_grid(parse_qs(route.query))
+        elif route.path == API_COUNT_ROUTE:
+            self.send_api_count(parse_qs(route.query))
+        elif route.path == API_STATS_ROUTE:
+            self.send_api_stats(parse_qs(route.query))
+        elif route.path == API_NEARBY_ROUTE:
+            self.send_api_nearby(parse_qs(route.query))
+        else:
+            super().do_GET()
+
+    def send_api_data(self, query):
+        """按类别、时间范围和视野筛选, 以data.v2.json紧凑格式返回匹配的案件"""
+        try:
+            flt = parse_filter(query)
+        except (ValueError, OverflowError):
+            self.send_error(400, "Invalid filter")
+            return
+        table, version = dataset.get()
+        key = hashlib.sha1(f"{version}|{filter_key(flt)}".encode('utf-8')).hexdigest()
+        use_gzip = 'gzip' in accepted_encodings(self.headers.get('Accept-Encoding'))
+        etag = f'"{key}-gzip"' if use_gzip else f'"{key}"'
+        self._vary_encoding = True
+        if etag_matches(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        rows = filter_indices(table, flt, dataset.spatial_index(), dataset.time_index())
+        payload = compact_payload(table.take(rows), version)
+        # 不限视野时的匹配总数, 供统计信息显示; 由时间索引直接计数
+        payload['matched'] = dataset.time_index().count(category_codes(table, flt), flt['start'], flt['end'])
+        self.send_json(payload, use_gzip, etag)
+
+    def send_api_grid(self, query):
+        """视野内筛选结果的聚合网格, 数据量与格子数相关而与案件数无关"""
+        try:
+            flt = parse_filter(query)
+            zoom = int(query['zoom'][0])
+            cell = finite_float(query['cell'][0]) if query.get('cell') else GRID_CELL_PIXELS
+            if flt['bbox'] is None or not 0 <= zoom <= MAX_ZOOM:
+                raise ValueError(zoom)
+        except (KeyError, ValueError, OverflowError):
+            self.send_error(400, "Invalid query")
+            return
+        table, version = dataset.get()
+        key = hashlib.sha1(f"{version}|{filter_key(flt)}|{zoom}|{cell}".encode('utf-8')).hexdigest()
+        use_gzip = 'gzip' in accepted_encodings(self.headers.get('Accept-Encoding'))
+        etag = f'"{key}-gzip"' if use_gzip else f'"{key}"'
+        self._vary_encoding = True
+        if etag_matches(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        rows = filter_indices(table, flt, dataset.spatial_index(), dataset.time_index())
+        payload = grid_payload(table, rows, flt['bbox'], zoom, cell, version)
+        # 与/api/data相同, matched为不限视野的匹配总数
+        payload['matched'] = dataset.time_index().count(category_codes(table, flt), flt['start'], flt['end'])
+        self.send_json(payload, use_gzip, etag)
+
+    def send_api_count(self, query):
+        """矩形和时间范围内的案件数及各类别案件数, 查表时间与案件数无关"""
+        try:
+            flt = parse_filter(query)
+        except (ValueError, OverflowError):
+            self.send_error(400, "Invalid filter")
+            return
+        table, version = dataset.get()
+        key = hashlib.sha1(f"{version}|{filter_key(flt)}|count".encode('utf-8')).hexdigest()
+        use_gzip = 'gzip' in accepted_encodings(self.headers.get('Accept-Encoding'))
+        etag = f'"{key}-gzip"' if use_gzip else f'"{key}"'
+        self._vary_encoding = True
+        if etag_matches(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        area = dataset.summed_area()
+        names = flt['categories'] or area.categories
+        codes = [area.categories.index(c) for c in names if c in area.categories]
+        counts = area.counts(codes, flt['start'], flt['end'], flt['bbox'])
+        by_category = {area.categories[c]: int(n) for c, n in zip(codes, counts) if n}
+        if flt['categories']:
+            total = int(counts.sum())
+        else:
+            # 不限类别时取全部案件槽, 包含类别缺失的记录
+            total = area.count(None, flt['start'], flt['end'], flt['bbox'])
+        payload = {'version': version, 'count': total, 'categories': by_category, 'approximate': True}
+        self.send_json(payload, use_gzip, etag)
+
+    def send_api_stats(self, query):
+        """匹配总数、类别数、类别排名、按天趋势和时段分布; bbox参数不起作用"""
+        try:
+            flt = parse_filter(query)
+            top = int(query['top'][0]) if query.get('top') else STATS_DEFAULT_TOP
+            if top < 1:
+                raise ValueError(f"top超出范围: {top}")
+        except (ValueError, OverflowError):
+            self.send_error(400, "Invalid filter")
+            return
+        table, version = dataset.get()
+        key = hashlib.sha1(f"{version}|{filter_key(flt)}|{top}".encode('utf-8')).hexdigest()
+        use_gzip = 'gzip' in accepted_encodings(self.headers.get('Accept-Encoding'))
+        etag = f'"{key}-gzip"' if use_gzip else f'"{key}"'
+        self._vary_encoding = True
+        if etag_matches(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        cube = dataset.stats_cube()
+        codes = category_codes(table, flt)
+        start, end = flt['start'], flt['end']
+        ranking = cube.top(len(cube.categories), start, end, codes)
+        first, series = cube.series(codes, start, end)
+        payload = {
+            'version': version,
+            'matched': cube.count(codes, start, end),
+            'categories': len(ranking),
+            'top': [[name, n] for name, n in ranking[:top]],
+            'series': {'start': first, 'counts': series},
+            'hours': cube.hour_profile(codes, start, end),
+        }
+        self.send_json(payload, use_gzip, etag)
+
+    def send_api_nearby(self, query):
+        """按空间索引查询某点附近的案件, 紧凑格式之外附带与各条记录对应的距离(米)"""
+        try:
+            flt = parse_filter(query)
+            lat = finite_float(query['lat'][0])
+            lng = finite_float(query['lng'][0])
+            radius = finite_float(query['radius'][0]) if query.get('radius') else None
+            # 只给半径时返回半径内全部案件(不超过上限)
+            default_k = NEARBY_MAX_K if radius is not None else NEARBY_DEFAULT_K
+            k = int(query['k'][0]) if query.get('k') else default_k
+            if not 1 <= k <= NEARBY_MAX_K:
+                raise ValueError(f"k超出范围: {k}")
+        except (KeyError, ValueError, OverflowError):
+            self.send_error(400, "Invalid query")
+            return
+        table, version = dataset.get()
+        index = dataset.spatial_index()
+
+        def keep(rows):
+            return rows[filter_mask(table, flt, rows)]
+
+        if radius is not None:
+            rows, distance = index.query_radius(lng, lat, radius, keep)
+            rows, distance = rows[:k], distance[:k]
+        else:
+            rows, distance = index.knn(lng, lat, k, keep)
+        # 紧凑格式按处警时间排序, 距离按同样顺序排列
+        subset = table.take(rows)
+        payload = compact_payload(subset, version)
+        payload['distance'] = np.round(distance[time_order(subset)], 1).tolist()
+        self._vary_encoding = True
+        self.send_json(payload, 'gzip' in accepted_encodings(self.headers.get('Accept-Encoding')))
+
+    def send_json(self, payload, use_gzip=False, etag=None):
+        body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        if use_gzip:
+            body = gzip.compress(body, compresslevel=5)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_heat_tile(self, z, x, y, query):
+        """返回服务器端渲染的热力瓦片, 支持ETag重新验证"""
+        if z > MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+            self.send_error(404, "Tile out of range")
+            return
+        try:
+            flt = parse_filter(query)
+        except (ValueError, OverflowError):
+            self.send_error(400, "Invalid filter")
+            return
+        table, version = dataset.get()
+        key = TileCache.make_key(version, filter_key(flt), z, x, y)
+        etag = f'"{key}"'
+        if etag_matches(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        data = tile_cache.get(key)
+        if data is None:
+            # 只取瓦片(含平滑边距)范围内的行, 渲染耗时与瓦片内的案件数相关而与数据集大小无关
+            west, south, east, north = tile_bounds(z, x, y)
+            if flt['bbox']:
+                west, south = max(west, flt['bbox'][0]), max(south, flt['bbox'][1])
+                east, north = min(east, flt['bbox'][2]), min(north, flt['bbox'][3])
+            if west < east and south < north:
+                rows = filter_indices(table, dict(flt, bbox=[west, south, east, north]), dataset.spatial_index())
+            else:
+                rows = np.empty(0, dtype=np.int64)
+            data = render_tile(table.lng[rows], table.lat[rows], z, x, y)
+            tile_cache.put(key, data)
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', etag)
         self.end_headers()
+        self.wfile.write(data)
 
     def log_message(self, format, *args):
         # 自定义日志格式
@@ -53,8 +307,38 @@ def find_available_port(start_port=8000, max_attempts=10):
             continue
     return None
 
-def start_mobile_server(port=None):
-    """启动移动端优化的HTTP服务器"""
+def prepare_dataset():
+    """主进程预先加载数据快照, 工作进程fork后共享同一份内存映射"""
+    try:
+        dataset.get()
+        dataset.spatial_index()
+        dataset.time_index()
+    except OSError as e:
+        print(f"数据集未加载: {e}")
+
+def dataset_stamp():
+    try:
+        return dataset.stamp()
+    except OSError:
+        return None
+
+def start_prefork_server(port, processes, workers=None, queue_size=None):
+    """多进程模式: 每个工作进程各自监听同一端口(SO_REUSEPORT), 数据变化时滚动重启"""
+    def make_server():
+        return ReusePortHTTPServer(("0.0.0.0", port), MobileHTTPRequestHandler,
+                                   workers=workers, queue_size=queue_size)
+
+    supervisor = PreforkSupervisor(make_server, processes, prepare=prepare_dataset, watch=dataset_stamp)
+    # 工作进程由fork创建, 继承这里设置的容量; 各进程的瓦片缓存合计不超过总容量
+    tile_cache.max_bytes = DEFAULT_CACHE_BYTES // supervisor.processes
+    print(f"服务器启动在端口 {port} ({supervisor.processes} 个工作进程)")
+    print("按 Ctrl+C 停止服务器, kill -HUP 主进程可滚动重启")
+    webbrowser.open(f'http://localhost:{port}')
+    supervisor.run()
+
+def start_mobile_server(port=None, workers=None, queue_size=None, processes=None):
+    """启动移动端优化的HTTP服务器(线程池并发处理, workers为并发数, queue_size为排队上限;
+    processes大于1时启用多进程模式)"""
     handler = MobileHTTPRequestHandler
     
     # 如果没有指定端口，查找可用端口
@@ -64,6 +348,9 @@ def start_mobile_server(port=None):
             print("错误：无法找到可用端口")
             return
     
+    # 生成/更新预压缩文件, 请求时直接返回压缩后的字节
+    precompress(verbose=False)
+    
     # 获取本机IP
     local_ip = get_local_ip()
     
@@ -81,18 +368,12 @@ def start_mobile_server(port=None):
     print("4. 点击左上角菜单按钮进行筛选")
     print("=" * 50)
     
+    if processes and processes > 1:
+        start_prefork_server(port, processes, workers, queue_size)
+        return
+    
     try:
-        with socketserver.TCPServer(("0.0.0.0", port), handler) as httpd:
-            print(f"服务器启动在端口 {port}")
-            print("按 Ctrl+C 停止服务器")
-            
-            # 自动打开浏览器
-            webbrowser.open(f'http://localhost:{port}')
-            
-            try:
-                httpd.serve_forever()
-            except KeyboardInterrupt:
-                print("\n服务器已停止")
+        httpd = PooledHTTPServer(("0.0.0.0", port), handler, workers=workers, queue_size=queue_size)
     except OSError as e:
         print(f"错误：无法启动服务器在端口 {port}")
         print(f"错误信息：{e}")
@@ -101,9 +382,21 @@ def start_mobile_server(port=None):
         alt_port = find_available_port(port + 1)
         if alt_port:
             print(f"尝试使用端口 {alt_port}")
-            start_mobile_server(alt_port)
+            start_mobile_server(alt_port, workers, queue_size, processes)
         else:
             print("无法找到可用端口，请检查网络设置")
+        return
+    
+    print(f"服务器启动在端口 {port} ({httpd.workers} 个工作线程, 排队上限 {httpd.queue_size})")
+    print("按 Ctrl+C 停止服务器")
+    
+    # 自动打开浏览器
+    webbrowser.open(f'http://localhost:{port}')
+    
+    serve_until_stopped(httpd)
+    stats = asset_cache.stats()
+    print(f"静态资源缓存: 命中 {stats['hits']} 次, 未命中 {stats['misses']} 次, "
+          f"{stats['entries']} 个文件 {stats['bytes'] / 1024:.1f} KB")
 
 def create_mobile_config():
     """创建移动端配置文件"""
@@ -113,7 +406,7 @@ def create_mobile_config():
         "gesture_support": True,
         "responsive_design": True,
         "offline_support": False,
-        "cache_strategy": "no-cache"
+        "cache_strategy": "etag-revalidate"
     }
     
     with open('mobile_config.json', 'w', encoding='utf-8') as f:
@@ -125,5 +418,5 @@ if __name__ == "__main__":
     # 创建移动端配置
     create_mobile_config()
     
-    # 启动服务器
-    start_mobile_server() 
\ No newline at end of file
+    # 启动服务器; python mobile_server.py [进程数] 启用多进程模式
+    start_mobile_server(processes=int(sys.argv[1]) if len(sys.argv) > 1 else None) 
\ No newline at end of file
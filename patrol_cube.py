@@ -0,0 +1,109 @@
+"""
+巡防时空立方体
+
+按 网格格子 x 一周中的小时(周一0时为0, 共168个) x 案件类别 统计案件数, 一次向量化分箱 + np.unique 建立。
+只保存非零项: 按 (类别 * 168 + 小时) 排序后以CSR方式存储, 每个 (类别, 小时) 是连续的一段 (格子, 案件数)。
+网格固定为城市范围(与summed_area、heat_tiles一致), 范围以外的记录不计入, 格子数与数据无关。
+选定班次(若干星期几的若干小时)和类别后, 热力图层只需取出对应的若干段按格子求和,
+与原始案件数无关, 切换班次时不需要重新扫描数据。
+
+xunfang.py把立方体嵌入生成的页面, 切换班次和类别时在浏览器中求和。
+"""
+
+import numpy as np
+
+from incident_table import NAT
+from spatial_index import DEFAULT_EXTENT, METRES_PER_DEGREE
+
+HOURS_PER_WEEK = 168
+DEFAULT_CELL_METRES = 50.0
+WEEKDAYS = ('周一', '周二', '周三', '周四', '周五', '周六', '周日')
+# (名称, 开始小时, 结束小时); 结束小时超过24表示跨到次日
+PATROL_SHIFTS = (
+    ('早班 08:00-16:00', 8, 16),
+    ('中班 16:00-24:00', 16, 24),
+    ('夜班 00:00-08:00', 0, 8),
+    ('夜间 20:00-次日04:00', 20, 28),
+)
+
+
+def hour_of_week(seconds):
+    """墙上时间秒数 -> 一周中的小时, 周一0时为0; 1970-01-01是周四"""
+    hours = np.asarray(seconds, dtype=np.int64) // 3600
+    return (hours + 3 * 24) % HOURS_PER_WEEK
+
+
+def shift_buckets(start_hour, end_hour, weekdays=range(7)):
+    """班次对应的一周中的小时; weekdays为班次开始的星期几(0为周一), 跨到次日的小时计入次日"""
+    return sorted({(day * 24 + hour) % HOURS_PER_WEEK
+                   for day in weekdays for hour in range(start_hour, end_hour)})
+
+
+class PatrolCube:
+    """格子 x 一周中的小时 x 类别 的稀疏计数"""
+
+    def __init__(self, west, south, dx, dy, nx, ny, categories, offsets, cells, counts):
+        self.west, self.south = west, south
+        self.dx, self.dy = dx, dy
+        self.nx, self.ny = nx, ny
+        self.categories = list(categories)
+        # 第 (类别 * 168 + 小时) 段为 cells/counts[offsets[k]:offsets[k+1]]
+        self.offsets = offsets
+        self.cells = cells
+        self.counts = counts
+
+    @classmethod
+    def build(cls, table, cell_metres=DEFAULT_CELL_METRES, extent=DEFAULT_EXTENT):
+        """没有处警时间或类别的记录, 以及extent范围以外的记录不计入"""
+        west, south, east, north = (float(v) for v in extent)
+        alarm = table.times['处警时间']
+        valid = ((alarm != NAT) & (table.codes >= 0)
+                 & (table.lng >= west) & (table.lng <= east) & (table.lat >= south) & (table.lat <= north))
+        lng, lat = table.lng[valid], table.lat[valid]
+        dy = cell_metres / METRES_PER_DEGREE
+        dx = dy / np.cos(np.radians((south + north) / 2))
+        nx = int((east - west) / dx) + 1
+        ny = int((north - south) / dy) + 1
+
+        col = np.minimum(((lng - west) / dx).astype(np.int64), nx - 1)
+        row = np.minimum(((lat - south) / dy).astype(np.int64), ny - 1)
+        cell = row * nx + col
+        slot = table.codes[valid].astype(np.int64) * HOURS_PER_WEEK + hour_of_week(alarm[valid])
+        keys, counts = np.unique(slot * (nx * ny) + cell, return_counts=True)
+        slots = len(table.categories) * HOURS_PER_WEEK
+        offsets = np.zeros(slots + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys // (nx * ny), minlength=slots), out=offsets[1:])
+        return cls(west, south, dx, dy, nx, ny, table.categories, offsets,
+                   (keys % (nx * ny)).astype(np.int32), counts.astype(np.int32))
+
+    def __len__(self):
+        """非零项数"""
+        return len(self.counts)
+
+    def layer(self, buckets=None, codes=None):
+        """班次(一周中的小时列表)和类别编码列表对应的热力图层, 返回 (格子中心纬度, 经度, 案件数)"""
+        buckets = range(HOURS_PER_WEEK) if buckets is None else buckets
+        codes = range(len(self.categories)) if codes is None else codes
+        slots = np.array([code * HOURS_PER_WEEK + bucket for code in codes for bucket in buckets], dtype=np.int64)
+        # 各段首尾相接的下标, 不逐段生成数组
+        starts = self.offsets[slots]
+        lengths = self.offsets[slots + 1] - starts
+        entries = np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        totals = np.bincount(self.cells[entries], weights=self.counts[entries], minlength=self.nx * self.ny)
+        cells = np.flatnonzero(totals)
+        lat = self.south + (cells // self.nx + 0.5) * self.dy
+        lng = self.west + (cells % self.nx + 0.5) * self.dx
+        return lat, lng, totals[cells].astype(np.int64)
+
+    def shift_layer(self, start_hour, end_hour, weekdays=range(7), codes=None):
+        return self.layer(shift_buckets(start_hour, end_hour, weekdays), codes)
+
+    def payload(self):
+        """嵌入页面的JSON内容"""
+        return {
+            'categories': self.categories,
+            'grid': [self.west, self.south, self.dx, self.dy, self.nx, self.ny],
+            'offsets': self.offsets.tolist(),
+            'cells': self.cells.tolist(),
+            'counts': self.counts.tolist(),
+        }
@@ -1,8 +1,9 @@
-import pandas as pd
-import json
+from data_cache import load_excel_cached
+from ingest import write_dataset
 
-# 读取Excel文件
-df = pd.read_excel('temp.xlsx')
+# 读取Excel文件(源文件未变化时直接加载解析缓存), 匹配列名并清洗为列式数据
+table = load_excel_cached('temp.xlsx')
+df = table.to_dataframe()
 
 # 显示基本信息
 print("数据形状:", df.shape)
@@ -16,10 +17,11 @@ print("\n数据统计:")
 print(df.describe())
 
 # 如果有案件类别列，显示类别分布
-if '案件类别' in df.columns:
+if table.categories:
     print("\n案件类别分布:")
-    print(df['案件类别'].value_counts())
+    for category, count in table.category_counts().items():
+        print(f"{category}: {count}")
 
 # 保存为JSON格式以便前端使用
-df.to_json('data.json', orient='records', force_ascii=False, indent=2)
-print("\n数据已保存为 data.json") 
\ No newline at end of file
+meta = write_dataset(table)
+print(f"\n数据已保存为 data.json (版本 {meta['version']})") 
\ No newline at end of file
@@ -1,10 +1,12 @@
 import http.server
-import socketserver
 import os
 import webbrowser
 from urllib.parse import urlparse
 
-class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
+from serving import KeepAliveMixin, PooledHTTPServer, serve_until_stopped
+from static_assets import PrecompressedMixin, asset_cache, precompress
+
+class MyHTTPRequestHandler(KeepAliveMixin, PrecompressedMixin, http.server.SimpleHTTPRequestHandler):
     def end_headers(self):
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
@@ -13,23 +15,27 @@ class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
 
     def do_OPTIONS(self):
         self.send_response(200)
+        self.send_header('Content-Length', '0')
         self.end_headers()
 
-def start_server(port=8080):  # 改为8080端口
-    """启动HTTP服务器"""
+def start_server(port=8080, workers=None, queue_size=None):  # 改为8080端口
+    """启动HTTP服务器(线程池并发处理, workers为并发数, queue_size为排队上限)"""
     handler = MyHTTPRequestHandler
     
-    with socketserver.TCPServer(("", port), handler) as httpd:
-        print(f"服务器启动在 http://localhost:{port}")
-        print("按 Ctrl+C 停止服务器")
-        
-        # 自动打开浏览器
-        webbrowser.open(f'http://localhost:{port}')
-        
-        try:
-            httpd.serve_forever()
-        except KeyboardInterrupt:
-            print("\n服务器已停止")
+    # 生成/更新预压缩文件, 请求时直接返回压缩后的字节
+    precompress(verbose=False)
+    
+    httpd = PooledHTTPServer(("", port), handler, workers=workers, queue_size=queue_size)
+    print(f"服务器启动在 http://localhost:{port} ({httpd.workers} 个工作线程)")
+    print("按 Ctrl+C 停止服务器")
+    
+    # 自动打开浏览器
+    webbrowser.open(f'http://localhost:{port}')
+    
+    serve_until_stopped(httpd)
+    stats = asset_cache.stats()
+    print(f"静态资源缓存: 命中 {stats['hits']} 次, 未命中 {stats['misses']} 次, "
+          f"{stats['entries']} 个文件 {stats['bytes'] / 1024:.1f} KB")
 
 if __name__ == "__main__":
     start_server() 
\ No newline at end of file
@@ -0,0 +1,261 @@
+"""
+服务器端数据集
+
+服务器进程只加载一次数据集, 数据文件变化时自动重新加载, 数据集版本用于各类缓存的键。
+解析结果以.npy快照保存在解析缓存(data_cache.py)中并以只读内存映射方式打开,
+多进程部署时各工作进程共享同一份物理内存。
+查询参数统一解析为筛选条件, 在列式数据上向量化求值。
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from data_cache import DataCache
+from export import COMPACT_FILE, load_compact_json
+from heat_tiles import TILE_SIZE
+from incident_table import NAT
+from ingest import DATA_FILE, load_dataset
+from spatial_index import SPATIAL_FILE, SpatialGrid
+from stats_cube import StatsCube
+from summed_area import AREA_FILE, SummedAreaTable
+from time_index import TimeIndex
+
+
+def load_snapshot(source, cache=None):
+    """按数据文件内容哈希取内存映射快照, 未命中时解析并写入; 返回 (IncidentTable, 快照键)"""
+    cache = cache or DataCache()
+    source = Path(source)
+    key = cache.key_for(source, ('server', source.name))
+    table = cache.get(key)
+    if table is None:
+        if source.name == COMPACT_FILE:
+            table = load_compact_json(source)
+        else:
+            table = load_dataset(source.parent)
+        try:
+            cache.put(key, table, source=source.resolve())
+            # 快照与解析缓存共用容量上限, 旧版本数据的快照按最近最少使用淘汰
+            cache.evict()
+        except OSError:
+            # 其他进程正在写入同一快照
+            pass
+        table = cache.get(key) or table
+    return table, key
+
+
+class ServerDataset:
+    """按数据文件修改时间自动重新加载的数据集"""
+
+    def __init__(self, directory='.', cache=None):
+        self.directory = Path(directory)
+        self.cache = cache
+        self.table = None
+        self.version = None
+        self._key = None
+        self._index = None
+        self._time_index = None
+        self._area = None
+        self._cube = None
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    def _source(self):
+        """优先使用紧凑格式, 解析更快"""
+        compact = self.directory / COMPACT_FILE
+        return compact if compact.exists() else self.directory / DATA_FILE
+
+    def stamp(self):
+        """数据文件的 (路径, 修改时间, 大小), 变化即需要重新加载"""
+        source = self._source()
+        stat = os.stat(source)
+        return (str(source), stat.st_mtime_ns, stat.st_size)
+
+    def get(self):
+        """返回 (IncidentTable, 数据集版本)"""
+        stamp = self.stamp()
+        if stamp != self._stamp:
+            with self._lock:
+                if stamp != self._stamp:
+                    # 版本取内容哈希, 各工作进程和重启前后一致, 可直接用于ETag
+                    table, key = load_snapshot(stamp[0], self.cache)
+                    self.table, self.version = table, key[:16]
+                    self._key, self._index, self._time_index = key, None, None
+                    self._area, self._cube = None, None
+                    self._stamp = stamp
+        return self.table, self.version
+
+    def spatial_index(self):
+        """当前数据集版本的空间索引; 保存在快照目录中, 重启后直接加载"""
+        self.get()
+        with self._lock:
+            # 重新加载数据集时_index被清空
+            if self._index is None:
+                table = self.table
+                path = (self.cache or DataCache()).cache_dir / self._key / SPATIAL_FILE
+                try:
+                    self._index = SpatialGrid.load(path, table.lng, table.lat)
+                except (OSError, ValueError, KeyError):
+                    self._index = SpatialGrid.build(table.lng, table.lat)
+                    try:
+                        self._index.save(path)
+                    except OSError:
+                        pass
+            return self._index
+
+    def time_index(self):
+        """当前数据集版本的处警时间索引"""
+        self.get()
+        with self._lock:
+            if self._time_index is None:
+                self._time_index = TimeIndex.build(self.table)
+            return self._time_index
+
+    def stats_cube(self):
+        """当前数据集版本的 类别 x 小时 统计立方体"""
+        self.get()
+        with self._lock:
+            if self._cube is None:
+                self._cube = StatsCube.build(self.table)
+            return self._cube
+
+    def summed_area(self):
+        """当前数据集的二维前缀和计数表; 优先加载ingest.py维护的data_area.npz"""
+        self.get()
+        with self._lock:
+            if self._area is None:
+                try:
+                    self._area = SummedAreaTable.load(self.directory / AREA_FILE)
+                    if self._area.rows != len(self.table):
+                        raise ValueError("计数表与数据集行数不一致")
+                except (OSError, ValueError, KeyError):
+                    self._area = SummedAreaTable.build(self.table)
+            return self._area
+
+
+# 服务器进程共享的数据集
+dataset = ServerDataset()
+
+# 按缩放级别把查询范围向外扩展的像素数, 与热力图核半径一致, 视野边缘的热力不会被截断
+BBOX_PADDING_PIXELS = 25
+# zoom参数的范围, 超出时取边界值
+MAX_ZOOM = 22
+# 时间参数的范围(墙上时间秒数), 超出时取边界值, 与int64时间列比较时不会溢出
+TIME_LIMIT = 2 ** 40
+
+
+def _first(query, name, convert=str):
+    values = query.get(name)
+    if not values or values[0] == '':
+        return None
+    return convert(values[0])
+
+
+def finite_float(value):
+    """解析为有限浮点数, inf/nan视为无效参数"""
+    result = float(value)
+    if not np.isfinite(result):
+        raise ValueError(f"参数不是有限数值: {value}")
+    return result
+
+
+def _clamp_time(seconds):
+    return None if seconds is None else int(np.clip(seconds, -TIME_LIMIT, TIME_LIMIT))
+
+
+def parse_filter(query):
+    """解析查询参数(parse_qs的结果)为筛选条件
+
+    category  案件类别, 可重复或用逗号分隔
+    start/end 处警时间范围, 墙上时间秒数
+    days      最近N天, 与index.html中的时间预设一致
+    bbox      经纬度范围 西,南,东,北
+    zoom      地图缩放级别, 给出时bbox向外扩展热力图核半径; 限制在0-22
+
+    参数格式无效(含inf/nan)时抛出ValueError
+    """
+    categories = []
+    for value in query.get('category', []):
+        categories.extend(c for c in value.split(',') if c)
+    start = _first(query, 'start', finite_float)
+    end = _first(query, 'end', finite_float)
+    days = _first(query, 'days', finite_float)
+    if days is not None:
+        # 墙上时间: 本地时间按UTC解释; 取整到分钟, 使同一分钟内的请求共用缓存
+        now = time.time() + time.localtime().tm_gmtoff
+        since = (now - days * 24 * 3600) // 60 * 60
+        start = since if start is None else max(start, since)
+    return {
+        'categories': sorted(set(categories)),
+        'start': _clamp_time(start),
+        'end': _clamp_time(end),
+        'bbox': parse_bbox(query),
+    }
+
+
+def parse_bbox(query):
+    """解析bbox和zoom参数, 返回 [西, 南, 东, 北] 或None"""
+    value = _first(query, 'bbox')
+    if value is None:
+        return None
+    west, south, east, north = (finite_float(v) for v in value.split(','))
+    if not (west < east and south < north):
+        raise ValueError(f"bbox范围无效: {value}")
+    zoom = _first(query, 'zoom', int)
+    if zoom is not None:
+        zoom = min(max(zoom, 0), MAX_ZOOM)
+        # 一个像素对应的经度; 墨卡托投影下纬度方向乘以cos(纬度)
+        pad = BBOX_PADDING_PIXELS * 360.0 / (TILE_SIZE * 2 ** zoom)
+        pad_lat = pad * np.cos(np.radians((south + north) / 2))
+        west, east = west - pad, east + pad
+        south, north = south - pad_lat, north + pad_lat
+    # 保留6位小数, 相同视野的请求得到相同的缓存键
+    return [round(v, 6) for v in (west, south, east, north)]
+
+
+def filter_key(flt):
+    """筛选条件的规范字符串, 用作缓存键"""
+    return json.dumps(flt, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+
+
+def category_codes(table, flt):
+    """筛选条件中类别对应的编码列表, 不限类别时为None"""
+    if not flt['categories']:
+        return None
+    return [table.categories.index(c) for c in flt['categories'] if c in table.categories]
+
+
+def filter_mask(table, flt, rows=None):
+    """筛选条件 -> 行掩码; 给出rows时只对这些行求值, 掩码与rows对应"""
+    def column(values):
+        return values if rows is None else values[rows]
+
+    mask = np.ones(len(table) if rows is None else len(rows), dtype=bool)
+    codes = category_codes(table, flt)
+    if codes is not None:
+        mask &= np.isin(column(table.codes), codes)
+    if flt.get('bbox'):
+        west, south, east, north = flt['bbox']
+        lng, lat = column(table.lng), column(table.lat)
+        mask &= (lng >= west) & (lng <= east) & (lat >= south) & (lat <= north)
+    alarm = column(table.times['处警时间'])
+    if flt['start'] is not None:
+        mask &= (alarm != NAT) & (alarm >= flt['start'])
+    if flt['end'] is not None:
+        mask &= (alarm != NAT) & (alarm <= flt['end'])
+    return mask
+
+
+def filter_indices(table, flt, index=None, time_index=None):
+    """筛选条件 -> 行下标, 不必扫描全表:
+    有bbox时先用空间索引取候选行; 只有类别和时间条件时用时间索引直接得到连续切片"""
+    if flt.get('bbox') and index is not None:
+        rows = index.query_bbox(*flt['bbox'])
+        return rows[filter_mask(table, dict(flt, bbox=None), rows)]
+    if not flt.get('bbox') and time_index is not None:
+        return time_index.query(category_codes(table, flt), flt['start'], flt['end'])
+    return np.flatnonzero(filter_mask(table, flt))
@@ -0,0 +1,341 @@
+"""
+并发HTTP服务
+
+socketserver.TCPServer 一次只处理一个请求, 一个慢速手机下载data.json时其他人都要排队。
+PooledHTTPServer 用固定大小的线程池处理请求:
+    - workers       同时处理的请求数
+    - queue_size    线程全忙时最多排队的连接数, 再多的连接等待accept_timeout秒后返回503(背压)
+    - request_timeout 单个连接的读写超时, 防止慢速客户端长期占用线程
+    - 收到 Ctrl+C / SIGTERM 后停止接收新连接, 等待正在处理的请求完成(最多drain_timeout秒)再退出
+
+PreforkSupervisor 预先启动多个工作进程(仅Linux等支持SO_REUSEPORT的系统), 每个进程各自绑定同一端口,
+由内核分配连接, 绕开单进程GIL的限制:
+    - 工作进程异常退出后自动重启(连续崩溃时退避)
+    - 数据文件变化或收到SIGHUP时逐个滚动重启: 先启动新进程并等待就绪, 再优雅停止旧进程
+
+KeepAliveMixin 让请求处理器使用HTTP/1.1持久连接, 静态文件用sendfile零拷贝发送,
+访问日志中记录该连接上的第几个请求和传输速率。
+"""
+
+import http.server
+import io
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_ACCEPT_TIMEOUT = 2.0
+DEFAULT_REQUEST_TIMEOUT = 30.0
+DEFAULT_DRAIN_TIMEOUT = 10.0
+# 持久连接等待下一个请求的最长时间, 空闲连接不长期占用工作线程
+DEFAULT_KEEP_ALIVE_TIMEOUT = 5.0
+DEFAULT_READY_TIMEOUT = 30.0
+# 工作进程启动后这么多秒内退出视为连续崩溃, 重启前等待
+CRASH_WINDOW = 5.0
+CRASH_BACKOFF = 1.0
+
+_BUSY_RESPONSE = (b"HTTP/1.0 503 Service Unavailable\r\n"
+                  b"Content-Type: text/plain; charset=utf-8\r\n"
+                  b"Content-Length: 12\r\n"
+                  b"Retry-After: 1\r\n"
+                  b"Connection: close\r\n\r\n"
+                  b"Server busy\n")
+
+
+class PooledHTTPServer(http.server.HTTPServer):
+    """线程池HTTP服务器, 并发数和排队长度有上限"""
+
+    allow_reuse_address = True
+    # 监听队列, 默认的5在多个手机同时打开页面时会溢出, 客户端要等1秒后重发SYN
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler, workers=None, queue_size=None,
+                 accept_timeout=DEFAULT_ACCEPT_TIMEOUT, request_timeout=DEFAULT_REQUEST_TIMEOUT,
+                 bind_and_activate=True):
+        self.workers = workers or DEFAULT_WORKERS
+        self.queue_size = DEFAULT_QUEUE_SIZE if queue_size is None else queue_size
+        self.accept_timeout = accept_timeout
+        self.request_timeout = request_timeout
+        # 处理中 + 排队中的连接数上限
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='http')
+        self._active = 0
+        self._idle = threading.Condition()
+        self.rejected = 0
+        super().__init__(server_address, handler, bind_and_activate)
+
+    def process_request(self, request, client_address):
+        if not self._slots.acquire(timeout=self.accept_timeout):
+            self.rejected += 1
+            self._reject(request)
+            return
+        with self._idle:
+            self._active += 1
+        if self.request_timeout:
+            request.settimeout(self.request_timeout)
+        self._pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+            with self._idle:
+                self._active -= 1
+                self._idle.notify_all()
+
+    def _reject(self, request):
+        """队列已满: 直接返回503, 客户端稍后重试"""
+        try:
+            request.settimeout(1.0)
+            request.sendall(_BUSY_RESPONSE)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def active_requests(self):
+        with self._idle:
+            return self._active
+
+    def busy(self):
+        """是否有连接在排队等待工作线程"""
+        with self._idle:
+            return self._active > self.workers
+
+    def drain(self, timeout=DEFAULT_DRAIN_TIMEOUT):
+        """等待正在处理的请求完成, 返回是否全部完成"""
+        deadline = time.monotonic() + timeout
+        with self._idle:
+            while self._active:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class KeepAliveMixin:
+    """BaseHTTPRequestHandler混入类: HTTP/1.1持久连接 + sendfile发送文件 + 带速率的访问日志"""
+
+    protocol_version = 'HTTP/1.1'
+    keep_alive_timeout = DEFAULT_KEEP_ALIVE_TIMEOUT
+    # 响应头和文件内容分两次写出, 持久连接上Nagle算法与延迟确认叠加会使每个请求多等约40毫秒
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self._request_timeout = self.connection.gettimeout()
+        self._connection_requests = 0
+
+    def handle_one_request(self):
+        if self._connection_requests:
+            self.connection.settimeout(self.keep_alive_timeout)
+        self._response_code = None
+        self._response_bytes = 0
+        self._request_start = time.perf_counter()
+        super().handle_one_request()
+        if self._response_code is None:
+            return
+        self._connection_requests += 1
+        self.log_access()
+        # 有连接在排队时关闭持久连接, 把工作线程让给其他客户端
+        busy = getattr(self.server, 'busy', None)
+        if busy and busy():
+            self.close_connection = True
+
+    def parse_request(self):
+        # 已收到请求行, 恢复正常的读写超时
+        self.connection.settimeout(self._request_timeout)
+        return super().parse_request()
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'content-length':
+            self._response_bytes = int(value)
+        super().send_header(keyword, value)
+
+    def copyfile(self, source, outputfile):
+        """发送文件: 内存中的内容一次写出, 磁盘文件优先使用os.sendfile(内核直接拷贝)"""
+        if outputfile is self.wfile and isinstance(source, io.BytesIO):
+            outputfile.write(source.getbuffer())
+        elif outputfile is self.wfile:
+            # socket.sendfile在源不是普通文件或平台不支持时自动退回send
+            self.connection.sendfile(source)
+        else:
+            super().copyfile(source, outputfile)
+
+    def log_request(self, code='-', size='-'):
+        # 响应发送完毕后由log_access统一记录
+        self._response_code = code
+
+    def log_error(self, format, *args):
+        # 持久连接空闲超时是正常关闭, 不记录
+        if self._connection_requests and format.startswith('Request timed out'):
+            return
+        super().log_error(format, *args)
+
+    def log_access(self):
+        elapsed = time.perf_counter() - self._request_start
+        code = getattr(self._response_code, 'value', self._response_code)
+        size = 0 if self.command == 'HEAD' or code == 304 else self._response_bytes
+        rate = size / elapsed / 1024 if elapsed > 0 else 0.0
+        self.log_message('"%s" %s %s 连接第%d个请求 %.1fms %.1fKB/s',
+                         self.requestline, code, size, self._connection_requests,
+                         elapsed * 1000, rate)
+
+
+class ReusePortHTTPServer(PooledHTTPServer):
+    """设置SO_REUSEPORT, 多个进程可以各自监听同一端口"""
+
+    def server_bind(self):
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+
+def serve_until_stopped(httpd, drain_timeout=DEFAULT_DRAIN_TIMEOUT, verbose=True):
+    """运行服务器直到 Ctrl+C 或 SIGTERM, 然后优雅退出"""
+    def stop(signum, frame):
+        # shutdown()会等待serve_forever返回, 不能在其所在线程中直接调用
+        threading.Thread(target=httpd.shutdown, daemon=True).start()
+
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, stop)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    if verbose:
+        print("\n正在停止服务器, 等待进行中的请求完成...")
+    if hasattr(httpd, 'drain') and not httpd.drain(drain_timeout):
+        print(f"仍有 {httpd.active_requests()} 个请求未完成, 强制退出")
+    httpd.server_close()
+    if verbose:
+        print("服务器已停止")
+
+
+def _worker_main(make_server, ready):
+    """工作进程: 创建服务器, 通知就绪后开始服务"""
+    # Ctrl+C和SIGHUP由主进程统一处理, 工作进程只响应SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    httpd = make_server()
+    ready.set()
+    serve_until_stopped(httpd, verbose=False)
+
+
+class PreforkSupervisor:
+    """多进程监督者
+
+    make_server  在工作进程中调用, 返回绑定了SO_REUSEPORT的服务器
+    prepare      启动或滚动重启工作进程前在主进程中调用, 例如预先生成数据快照
+    watch        返回数据版本标记的函数, 标记变化时滚动重启
+    """
+
+    def __init__(self, make_server, processes=None, prepare=None, watch=None, poll_interval=2.0):
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            raise RuntimeError("当前系统不支持SO_REUSEPORT, 无法使用多进程模式")
+        self.make_server = make_server
+        self.processes = processes or os.cpu_count() or 1
+        self.prepare = prepare
+        self.watch = watch
+        self.poll_interval = poll_interval
+        # fork启动: 工作进程直接继承主进程已映射的数据
+        self._ctx = multiprocessing.get_context('fork')
+        self._workers = []
+        self._stopping = False
+        self._reload = False
+
+    def _spawn(self):
+        ready = self._ctx.Event()
+        process = self._ctx.Process(target=_worker_main, args=(self.make_server, ready), daemon=True)
+        process.start()
+        return {'process': process, 'ready': ready, 'started': time.monotonic()}
+
+    def _stop_worker(self, worker, timeout=DEFAULT_DRAIN_TIMEOUT):
+        process = worker['process']
+        if process.is_alive():
+            process.terminate()
+        process.join(timeout + 1)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+    def rolling_restart(self):
+        """逐个替换工作进程, 任何时刻都有进程在监听端口"""
+        if self.prepare:
+            self.prepare()
+        for i, old in enumerate(list(self._workers)):
+            new = self._spawn()
+            if not new['ready'].wait(DEFAULT_READY_TIMEOUT):
+                print(f"新工作进程 {new['process'].pid} 未能就绪, 保留旧进程 {old['process'].pid}")
+                self._stop_worker(new)
+                continue
+            self._workers[i] = new
+            self._stop_worker(old)
+        print(f"已滚动重启 {len(self._workers)} 个工作进程")
+
+    def _check_workers(self):
+        """重启异常退出的工作进程"""
+        for i, worker in enumerate(self._workers):
+            process = worker['process']
+            if process.is_alive():
+                continue
+            print(f"工作进程 {process.pid} 已退出(退出码 {process.exitcode}), 正在重启")
+            if time.monotonic() - worker['started'] < CRASH_WINDOW:
+                time.sleep(CRASH_BACKOFF)
+            self._workers[i] = self._spawn()
+
+    def run(self):
+        """启动工作进程并监督, 直到 Ctrl+C 或 SIGTERM"""
+        def stop(signum, frame):
+            self._stopping = True
+
+        def reload(signum, frame):
+            self._reload = True
+
+        signal.signal(signal.SIGTERM, stop)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, reload)
+
+        if self.prepare:
+            self.prepare()
+        stamp = self.watch() if self.watch else None
+        self._workers = [self._spawn() for _ in range(self.processes)]
+        print(f"已启动 {self.processes} 个工作进程: {', '.join(str(w['process'].pid) for w in self._workers)}")
+        try:
+            while not self._stopping:
+                time.sleep(self.poll_interval)
+                self._check_workers()
+                if self.watch:
+                    try:
+                        current = self.watch()
+                    except OSError:
+                        current = stamp
+                    if current != stamp:
+                        print("数据文件已变化, 滚动重启工作进程")
+                        stamp = current
+                        self._reload = True
+                if self._reload:
+                    self._reload = False
+                    self.rolling_restart()
+        except KeyboardInterrupt:
+            pass
+        print("\n正在停止工作进程, 等待进行中的请求完成...")
+        for worker in self._workers:
+            if worker['process'].is_alive():
+                worker['process'].terminate()
+        for worker in self._workers:
+            self._stop_worker(worker)
+        print("服务器已停止")
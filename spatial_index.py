@@ -0,0 +1,162 @@
+"""
+案件空间索引
+
+均匀网格: 按数据范围和点数确定格子大小(边长在米制下为正方形), 点按格子编号排序后以CSR方式存储,
+每行格子在排序后的数组中是连续的一段, 范围查询只需按行取出若干连续切片再精确过滤。
+网格范围限制在配置的城市范围(DEFAULT_EXTENT)以内, 范围外的点(如误录为(0, 0)的坐标)放在order末尾的
+溢出段, 每次查询都作为候选参与精确过滤, 避免个别离群点把网格撑到数十亿个格子。
+支持矩形范围、半径和K近邻查询; 网格(排序下标和行偏移)可以保存到磁盘, 启动时直接加载。
+"""
+
+import os
+from pathlib import Path
+
+import numpy as np
+
+SPATIAL_FILE = 'spatial.npz'
+EARTH_RADIUS = 6371008.8
+METRES_PER_DEGREE = np.pi * EARTH_RADIUS / 180
+# 连云港市区范围 (west, south, east, north), 与index.html中的lianyungangBounds一致
+DEFAULT_EXTENT = (119.1453, 34.3665, 119.3549, 34.6690)
+# 平均每个格子的目标点数, 以及格子边长的范围(米)
+TARGET_POINTS_PER_CELL = 32
+MIN_CELL_METRES = 25.0
+MAX_CELL_METRES = 2000.0
+
+
+def haversine(lng, lat, lng0, lat0):
+    """各点到 (lng0, lat0) 的球面距离(米)"""
+    lng, lat = np.radians(lng), np.radians(lat)
+    lng0, lat0 = np.radians(lng0), np.radians(lat0)
+    a = (np.sin((lat - lat0) / 2) ** 2
+         + np.cos(lat) * np.cos(lat0) * np.sin((lng - lng0) / 2) ** 2)
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class SpatialGrid:
+    """经纬度点的均匀网格索引, 查询结果为原数组中的下标"""
+
+    def __init__(self, lng, lat, west, south, dx, dy, nx, ny, order, offsets):
+        self.lng = lng
+        self.lat = lat
+        self.west, self.south = west, south
+        self.dx, self.dy = dx, dy
+        self.nx, self.ny = nx, ny
+        self.order = order
+        self.offsets = offsets
+        # 网格范围以外的点
+        self.overflow = order[offsets[-1]:]
+
+    @classmethod
+    def build(cls, lng, lat, cell_metres=None, extent=DEFAULT_EXTENT):
+        """建立索引; 未给出格子边长时按点数和范围自动确定, 网格不超出extent"""
+        lng = np.asarray(lng, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        valid = np.isfinite(lng) & np.isfinite(lat)
+        if not valid.any():
+            return cls(lng, lat, 0.0, 0.0, 1.0, 1.0, 1, 1,
+                       np.empty(0, dtype=np.int64), np.zeros(2, dtype=np.int64))
+        inside = valid & (lng >= extent[0]) & (lat >= extent[1]) & (lng <= extent[2]) & (lat <= extent[3])
+        if inside.any():
+            west, east = float(lng[inside].min()), float(lng[inside].max())
+            south, north = float(lat[inside].min()), float(lat[inside].max())
+        else:
+            west, south, east, north = (float(v) for v in extent)
+        cos_lat = np.cos(np.radians((south + north) / 2))
+        if cell_metres is None:
+            area = max((east - west) * cos_lat * (north - south), 1e-12) * METRES_PER_DEGREE ** 2
+            cells = max(int(inside.sum()) / TARGET_POINTS_PER_CELL, 1)
+            cell_metres = float(np.clip(np.sqrt(area / cells), MIN_CELL_METRES, MAX_CELL_METRES))
+        dy = cell_metres / METRES_PER_DEGREE
+        dx = dy / cos_lat
+        nx = int((east - west) / dx) + 1
+        ny = int((north - south) / dy) + 1
+
+        points = np.flatnonzero(inside)
+        cells = cls._cells(lng[points], lat[points], west, south, dx, dy, nx, ny)
+        order = np.concatenate([points[np.argsort(cells, kind='stable')], np.flatnonzero(valid & ~inside)])
+        counts = np.bincount(cells, minlength=nx * ny)
+        offsets = np.zeros(nx * ny + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(lng, lat, west, south, dx, dy, nx, ny, order, offsets)
+
+    @staticmethod
+    def _cells(lng, lat, west, south, dx, dy, nx, ny):
+        col = np.clip(((lng - west) / dx).astype(np.int64), 0, nx - 1)
+        row = np.clip(((lat - south) / dy).astype(np.int64), 0, ny - 1)
+        return row * nx + col
+
+    def __len__(self):
+        return len(self.order)
+
+    def _candidates(self, west, south, east, north):
+        """与矩形相交的格子中的所有点, 以及网格范围以外的点"""
+        c0 = int(np.floor((west - self.west) / self.dx))
+        c1 = int(np.floor((east - self.west) / self.dx))
+        r0 = int(np.floor((south - self.south) / self.dy))
+        r1 = int(np.floor((north - self.south) / self.dy))
+        if c1 < 0 or r1 < 0 or c0 >= self.nx or r0 >= self.ny:
+            return self.overflow
+        c0, c1 = max(c0, 0), min(c1, self.nx - 1)
+        r0, r1 = max(r0, 0), min(r1, self.ny - 1)
+        if c0 > c1 or r0 > r1:
+            return self.overflow
+        rows = np.arange(r0, r1 + 1) * self.nx
+        starts = self.offsets[rows + c0]
+        ends = self.offsets[rows + c1 + 1]
+        return np.concatenate([self.order[s:e] for s, e in zip(starts, ends)] + [self.overflow])
+
+    def query_bbox(self, west, south, east, north):
+        """矩形范围内的点, 下标升序"""
+        idx = self._candidates(west, south, east, north)
+        lng, lat = self.lng[idx], self.lat[idx]
+        inside = (lng >= west) & (lng <= east) & (lat >= south) & (lat <= north)
+        return np.sort(idx[inside])
+
+    def query_radius(self, lng, lat, metres, keep=None):
+        """半径(米)内的点, 返回 (下标, 距离), 按距离升序; keep可对候选下标做额外筛选"""
+        dlat = metres / METRES_PER_DEGREE
+        dlng = dlat / max(np.cos(np.radians(lat)), 1e-6)
+        idx = self._candidates(lng - dlng, lat - dlat, lng + dlng, lat + dlat)
+        if keep is not None:
+            idx = keep(idx)
+        dist = haversine(self.lng[idx], self.lat[idx], lng, lat)
+        inside = dist <= metres
+        idx, dist = idx[inside], dist[inside]
+        order = np.argsort(dist, kind='stable')
+        return idx[order], dist[order]
+
+    def knn(self, lng, lat, k, keep=None):
+        """最近的k个点, 返回 (下标, 距离), 按距离升序; 搜索半径从一个格子开始逐步扩大"""
+        if k <= 0 or not len(self):
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        radius = self.dy * METRES_PER_DEGREE
+        # 覆盖整个网格所需的最大半径
+        span = np.hypot(self.nx * self.dx * np.cos(np.radians(lat)), self.ny * self.dy) * METRES_PER_DEGREE
+        far = span + haversine(np.array([self.west]), np.array([self.south]), lng, lat)[0]
+        if len(self.overflow):
+            far = max(far, haversine(self.lng[self.overflow], self.lat[self.overflow], lng, lat).max())
+        while True:
+            idx, dist = self.query_radius(lng, lat, radius, keep)
+            if len(idx) >= k or radius >= far:
+                return idx[:k], dist[:k]
+            radius *= 2
+
+    def save(self, path):
+        """保存网格到.npz文件(不含坐标), 先写临时文件再原子替换"""
+        path = Path(path)
+        tmp = path.with_name(f".{path.stem}.{os.getpid()}.tmp.npz")
+        params = np.array([self.west, self.south, self.dx, self.dy, self.nx, self.ny, len(self.lng)])
+        np.savez(tmp, params=params, order=self.order, offsets=self.offsets)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, lng, lat):
+        """加载网格, 坐标数组需与建立索引时相同"""
+        with np.load(path) as data:
+            params, order, offsets = data['params'], data['order'], data['offsets']
+        west, south, dx, dy, nx, ny, count = params
+        if int(count) != len(lng):
+            raise ValueError(f"空间索引 {path} 与数据集行数不一致")
+        return cls(np.asarray(lng, dtype=np.float64), np.asarray(lat, dtype=np.float64),
+                   float(west), float(south), float(dx), float(dy), int(nx), int(ny), order, offsets)
@@ -0,0 +1,405 @@
+"""
+静态资源预压缩
+
+构建时为每个文本资源生成 .gz 和 .br 同名文件(brotli模块未安装时只生成.gz),
+请求处理器根据 Accept-Encoding 直接返回预压缩的字节, 请求时不再做任何压缩。
+
+缓存策略: 响应带强ETag(内容哈希, 文件变化时重新计算)和Last-Modified, 条件请求返回304;
+文件名带内容哈希的资源(shards/*.{哈希}.bin)长期缓存, 数据集和页面每次重新验证。
+
+进程内资源缓存(AssetCache): 把文件内容、预压缩变体、内容哈希和MIME类型保存在内存中,
+每次请求只stat一下源文件和变体, 修改时间/大小/inode变化时重新读取; 总大小超过上限时按最近最少使用淘汰。
+
+用法:
+    python static_assets.py [目录]
+"""
+
+import email.utils
+import gzip
+import hashlib
+import io
+import os
+import re
+import sys
+import threading
+import urllib.parse
+from collections import OrderedDict
+from http import HTTPStatus
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 需要预压缩的资源类型
+COMPRESSIBLE_SUFFIXES = ('.html', '.htm', '.js', '.css', '.json', '.bin', '.svg', '.txt', '.md')
+
+# 按优先级排列: (Content-Encoding, 文件后缀)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# 跳过的目录
+SKIP_DIRS = {'.git', '.heatmap_cache', 'node_modules', '__pycache__', '.vercel', '.netlify'}
+
+# 资源缓存的总大小上限, 以及单个文件的大小上限(更大的文件直接从磁盘sendfile)
+DEFAULT_ASSET_CACHE_BYTES = 64 * 1024 * 1024
+DEFAULT_ASSET_MAX_FILE_BYTES = 16 * 1024 * 1024
+
+# 各类资源的Cache-Control
+IMMUTABLE_POLICY = 'public, max-age=31536000, immutable'
+REVALIDATE_POLICY = 'no-cache'
+STATIC_POLICY = 'public, max-age=300, must-revalidate'
+# 文件名中带12位以上十六进制内容哈希的资源内容永不变化
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12,}\.[^./]+$')
+# 内容会被更新的数据集和页面, 每次都需要重新验证
+MUTABLE_SUFFIXES = ('.html', '.htm', '.json', '.bin')
+
+
+def _compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=11)
+    # mtime固定为0, 内容不变时输出字节也不变
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def precompress(directory='.', verbose=True):
+    """为目录下的文本资源生成预压缩文件, 已是最新的跳过; 返回写出的文件数"""
+    written = 0
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+        for name in files:
+            if not name.lower().endswith(COMPRESSIBLE_SUFFIXES):
+                continue
+            source = os.path.join(root, name)
+            source_mtime = os.stat(source).st_mtime
+            data = None
+            for encoding, suffix in ENCODINGS:
+                if encoding == 'br' and brotli is None:
+                    continue
+                target = source + suffix
+                if os.path.exists(target) and os.stat(target).st_mtime >= source_mtime:
+                    continue
+                if data is None:
+                    with open(source, 'rb') as f:
+                        data = f.read()
+                compressed = _compress(data, encoding)
+                # 压缩后没有变小的资源不生成, 直接返回原文件
+                if len(compressed) >= len(data):
+                    if os.path.exists(target):
+                        os.remove(target)
+                    continue
+                with open(target, 'wb') as f:
+                    f.write(compressed)
+                written += 1
+                if verbose:
+                    print(f"  {target}: {len(data)} -> {len(compressed)} 字节")
+    if verbose:
+        print(f"预压缩完成, 写出 {written} 个文件" + ('' if brotli else ' (未安装brotli, 仅生成gzip)'))
+    return written
+
+
+def accepted_encodings(header):
+    """解析Accept-Encoding, 返回可接受的编码集合(忽略q=0)"""
+    accepted = set()
+    for part in (header or '').split(','):
+        token, _, params = part.strip().partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if q > 0:
+            accepted.add(token)
+    return accepted
+
+
+def precompressed_variants(path):
+    """返回与源文件同步的预压缩文件 [(编码, 路径)], 过期的不算"""
+    try:
+        source_mtime = os.stat(path).st_mtime
+    except OSError:
+        return []
+    variants = []
+    for encoding, suffix in ENCODINGS:
+        target = path + suffix
+        try:
+            if os.stat(target).st_mtime >= source_mtime:
+                variants.append((encoding, target))
+        except OSError:
+            continue
+    return variants
+
+
+def cache_policy(path):
+    """资源对应的Cache-Control"""
+    name = os.path.basename(path)
+    if HASHED_NAME.search(name):
+        return IMMUTABLE_POLICY
+    if name.lower().endswith(MUTABLE_SUFFIXES):
+        return REVALIDATE_POLICY
+    return STATIC_POLICY
+
+
+_etags = {}
+_etags_lock = threading.Lock()
+
+
+def _stamp(stat):
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+def _etag(digest):
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+def content_etag(path):
+    """文件内容哈希作为强ETag, 按 (修改时间, 大小, inode) 记住, 文件变化时重新计算"""
+    stamp = _stamp(os.stat(path))
+    with _etags_lock:
+        cached = _etags.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    etag = _etag(digest)
+    with _etags_lock:
+        _etags[path] = (stamp, etag)
+    return etag
+
+
+def etag_matches(header, etag):
+    """If-None-Match是否命中(弱比较)"""
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    tag = etag[2:] if etag.startswith('W/') else etag
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == tag:
+            return True
+    return False
+
+
+def not_modified(headers, etag, mtime):
+    """条件请求是否可以返回304; 有If-None-Match时忽略If-Modified-Since"""
+    if headers.get('If-None-Match'):
+        return etag_matches(headers['If-None-Match'], etag)
+    since = headers.get('If-Modified-Since')
+    if not since:
+        return False
+    try:
+        since = email.utils.parsedate_to_datetime(since).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return False
+    return int(mtime) <= since
+
+
+class CachedAsset:
+    """内存中的一个静态资源"""
+
+    def __init__(self, stamp, variant_stamps, body, variants, content_type, mtime):
+        self.stamp = stamp
+        self.variant_stamps = variant_stamps
+        self.body = body
+        # {编码: 预压缩字节}
+        self.variants = variants
+        self.content_type = content_type
+        self.mtime = mtime
+        self.etag = _etag(hashlib.sha256(body))
+        self.size = len(body) + sum(len(v) for v in variants.values())
+
+
+class AssetCache:
+    """进程内静态资源缓存, 按文件状态失效, 按总字节数LRU淘汰"""
+
+    def __init__(self, max_bytes=DEFAULT_ASSET_CACHE_BYTES, max_file_bytes=DEFAULT_ASSET_MAX_FILE_BYTES):
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self._entries = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _variant_stamps(path, source_stat):
+        """与源文件同步的预压缩变体 ((编码, 文件状态), ...)"""
+        stamps = []
+        for encoding, suffix in ENCODINGS:
+            try:
+                stat = os.stat(path + suffix)
+            except OSError:
+                continue
+            if stat.st_mtime >= source_stat.st_mtime:
+                stamps.append((encoding, _stamp(stat)))
+        return tuple(stamps)
+
+    def get(self, path, content_type):
+        """返回CachedAsset; 文件不存在或超过单文件上限时返回None, 由调用方从磁盘发送"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if stat.st_size > self.max_file_bytes:
+            return None
+        stamp = _stamp(stat)
+        variant_stamps = self._variant_stamps(path, stat)
+        with self._lock:
+            asset = self._entries.get(path)
+            if asset is not None and asset.stamp == stamp and asset.variant_stamps == variant_stamps:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return asset
+            self.misses += 1
+
+        try:
+            with open(path, 'rb') as f:
+                body = f.read()
+            variants = {}
+            for encoding, _ in variant_stamps:
+                with open(path + dict(ENCODINGS)[encoding], 'rb') as f:
+                    variants[encoding] = f.read()
+        except OSError:
+            return None
+        asset = CachedAsset(stamp, variant_stamps, body, variants, content_type(path), stat.st_mtime)
+
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self._total -= old.size
+            if asset.size <= self.max_bytes:
+                self._entries[path] = asset
+                self._total += asset.size
+            while self._total > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total -= evicted.size
+                self.evictions += 1
+        return asset
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total = 0
+
+
+# 进程内共享的资源缓存
+asset_cache = AssetCache()
+
+
+class PrecompressedMixin:
+    """SimpleHTTPRequestHandler混入类: 按Accept-Encoding返回预压缩文件, 按资源类别设置缓存策略和ETag"""
+
+    # 没有按资源类别设置策略的响应(错误页、接口等)使用的Cache-Control, None为不发送
+    default_cache_control = None
+    # 进程内资源缓存, None为每次从磁盘读取
+    asset_cache = asset_cache
+
+    def _static_file_path(self):
+        """请求对应的静态文件路径(目录取index.html), 不是文件时返回None"""
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            if not urllib.parse.urlsplit(self.path).path.endswith('/'):
+                return None
+            path = os.path.join(path, 'index.html')
+        return path if os.path.isfile(path) else None
+
+    def _choose_encoding(self, encodings):
+        """在可用的预压缩编码中选择客户端接受的一个, 没有则返回None"""
+        if not encodings:
+            return None
+        self._vary_encoding = True
+        accepted = accepted_encodings(self.headers.get('Accept-Encoding'))
+        for encoding in encodings:
+            if encoding in accepted:
+                return encoding
+        return None
+
+    def _send_static_headers(self, path, content_type, encoding, etag, mtime, length):
+        """发送静态资源的响应头; 条件请求命中时发送304并返回False"""
+        if encoding:
+            # 同一资源的不同编码字节不同, 强ETag必须区分
+            etag = f'{etag[:-1]}-{encoding}"'
+        self._cache_control = cache_policy(path)
+        if not_modified(self.headers, etag, mtime):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return False
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-type', content_type)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(length))
+        self.send_header('Last-Modified', self.date_time_string(mtime))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        return True
+
+    def send_head(self):
+        self._vary_encoding = False
+        path = self._static_file_path()
+        if path is None:
+            return super().send_head()
+
+        # 热点资源直接从内存返回
+        cache = getattr(self, 'asset_cache', None)
+        asset = cache.get(path, self.guess_type) if cache is not None else None
+        if asset is not None:
+            encoding = self._choose_encoding(list(asset.variants))
+            body = asset.variants[encoding] if encoding else asset.body
+            if not self._send_static_headers(path, asset.content_type, encoding, asset.etag,
+                                             asset.mtime, len(body)):
+                return None
+            return io.BytesIO(body)
+
+        variants = dict(precompressed_variants(path))
+        encoding = self._choose_encoding(list(variants))
+        try:
+            f = open(variants[encoding] if encoding else path, 'rb')
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+        try:
+            length = os.fstat(f.fileno()).st_size
+            if not self._send_static_headers(path, self.guess_type(path), encoding, content_etag(path),
+                                             os.stat(path).st_mtime, length):
+                f.close()
+                return None
+            return f
+        except Exception:
+            f.close()
+            raise
+
+    def end_headers(self):
+        if getattr(self, '_vary_encoding', False):
+            self.send_header('Vary', 'Accept-Encoding')
+            self._vary_encoding = False
+        policy = getattr(self, '_cache_control', None) or self.default_cache_control
+        if policy:
+            self.send_header('Cache-Control', policy)
+        self._cache_control = None
+        super().end_headers()
+
+
+if __name__ == '__main__':
+    precompress(sys.argv[1] if len(sys.argv) > 1 else '.')
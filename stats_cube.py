@@ -0,0 +1,179 @@
+"""
+案件统计立方体
+
+按 案件类别 x 小时(处警时间所在的整点) 统计案件数, 沿时间方向做前缀和:
+cum[c, t] 为类别c在前t个小时中的案件数。任意类别子集 + 时间范围的案件数、类别排名(Top N)、
+按天的趋势序列都只需查表, 与案件数无关; 再按 天 x 一天中的小时 折叠做前缀和, 得到任意日期范围的时段分布。
+最后一个类别槽为全部案件(含类别缺失的记录); 无处警时间的记录单独计数, 只在不限时间时计入。
+
+精度: 时间范围按整点对齐(与范围相交的小时整小时计入), 时段分布按天对齐。
+
+导出为 stats_cube.json: 稀疏格式, 只写非零的 (类别槽, 小时, 案件数), 类别槽等于类别数时表示类别缺失;
+index.html加载后在浏览器中建立同样的前缀和, mobile_server.py的/api/stats由内存中的立方体直接回答。
+增量导入时读取已有的stats_cube.json, 只把新记录的计数加到对应的 (类别, 小时) 上。
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+
+from incident_table import NAT
+
+CUBE_FORMAT = 'stats-cube-v1'
+CUBE_FILE = 'stats_cube.json'
+HOUR = 3600
+HOURS_PER_DAY = 24
+
+
+class StatsCube:
+    """类别 x 小时的前缀和立方体; 时间为墙上时间秒数"""
+
+    def __init__(self, categories, hour0, hourly, undated):
+        self.categories = list(categories)
+        # 第一个小时(整点序号), 对齐到当天0点, 时间轴长度为整数天
+        self.hour0 = hour0
+        self.hours = hourly.shape[1]
+        self.days = self.hours // HOURS_PER_DAY
+        self.hourly = hourly
+        self.undated = undated
+        self.cum = np.zeros((hourly.shape[0], self.hours + 1), dtype=np.int64)
+        np.cumsum(hourly, axis=1, out=self.cum[:, 1:])
+        by_day = hourly.reshape(hourly.shape[0], self.days, HOURS_PER_DAY)
+        self.day_cum = np.zeros((hourly.shape[0], self.days + 1, HOURS_PER_DAY), dtype=np.int64)
+        np.cumsum(by_day, axis=1, out=self.day_cum[:, 1:])
+
+    @classmethod
+    def build(cls, table):
+        """一次np.bincount统计各 (类别槽, 小时) 的案件数"""
+        slots = len(table.categories) + 1
+        alarm = table.times['处警时间']
+        dated = alarm != NAT
+        codes = np.where(table.codes >= 0, table.codes, slots - 1).astype(np.int64)
+        hours = alarm[dated] // HOUR
+        if len(hours):
+            hour0 = int(hours.min()) // HOURS_PER_DAY * HOURS_PER_DAY
+            length = (int(hours.max()) // HOURS_PER_DAY + 1) * HOURS_PER_DAY - hour0
+        else:
+            hour0, length = 0, 0
+        hourly = np.bincount(codes[dated] * length + (hours - hour0),
+                             minlength=slots * length).reshape(slots, length)
+        undated = np.bincount(codes[~dated], minlength=slots)
+        # 最后一个槽改为全部案件
+        hourly[-1] = hourly.sum(axis=0)
+        undated[-1] = undated.sum()
+        return cls(table.categories, hour0, hourly, undated)
+
+    @classmethod
+    def from_payload(cls, payload):
+        """由stats_cube.json的内容还原"""
+        if payload.get('format') != CUBE_FORMAT:
+            raise ValueError(f"不是 {CUBE_FORMAT} 格式")
+        slots = len(payload['categories']) + 1
+        hourly = np.zeros((slots, payload['hours']), dtype=np.int64)
+        hourly[payload['slot'], payload['hour']] = payload['count']
+        undated = np.asarray(payload['undated'], dtype=np.int64)
+        hourly[-1] = hourly.sum(axis=0)
+        undated[-1] = undated.sum()
+        return cls(payload['categories'], payload['hour0'], hourly, undated)
+
+    @classmethod
+    def load(cls, path=CUBE_FILE):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_payload(json.load(f))
+
+    def append(self, table):
+        """加上新记录的计数, 返回新的立方体; 类别取并集, 时间轴按需要向两端扩展"""
+        other = StatsCube.build(table)
+        if not other.hours and not other.undated[-1]:
+            return self
+        categories = sorted(set(self.categories) | set(other.categories))
+        spans = [(cube.hour0, cube.hour0 + cube.hours) for cube in (self, other) if cube.hours]
+        hour0 = min(start for start, _ in spans) if spans else 0
+        hours = max(end for _, end in spans) - hour0 if spans else 0
+        hourly = np.zeros((len(categories) + 1, hours), dtype=np.int64)
+        undated = np.zeros(len(categories) + 1, dtype=np.int64)
+        for cube in (self, other):
+            slots = [categories.index(c) for c in cube.categories] + [len(categories)]
+            start = cube.hour0 - hour0
+            hourly[slots, start:start + cube.hours] += cube.hourly
+            undated[slots] += cube.undated
+        return StatsCube(categories, hour0, hourly, undated)
+
+    def save(self, path=CUBE_FILE, version=0):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.payload(version), f, ensure_ascii=False, separators=(',', ':'))
+        return Path(path)
+
+    def _slots(self, codes):
+        return [len(self.categories)] if codes is None else list(codes)
+
+    def window(self, start=None, end=None):
+        """处警时间范围 -> 小时下标范围 [t0, t1)"""
+        t0 = 0 if start is None else int(np.clip(start // HOUR - self.hour0, 0, self.hours))
+        t1 = self.hours if end is None else int(np.clip(end // HOUR - self.hour0 + 1, 0, self.hours))
+        return t0, max(t0, t1)
+
+    def counts(self, codes=None, start=None, end=None):
+        """各类别在时间范围内的案件数; codes为None时返回全部案件数(长度为1的数组)"""
+        slots = self._slots(codes)
+        t0, t1 = self.window(start, end)
+        result = self.cum[slots, t1] - self.cum[slots, t0]
+        if start is None and end is None:
+            result = result + self.undated[slots]
+        return result
+
+    def count(self, codes=None, start=None, end=None):
+        return int(self.counts(codes, start, end).sum())
+
+    def top(self, n=10, start=None, end=None, codes=None):
+        """案件数最多的n个类别 [(类别, 案件数)], 只包含有案件的类别; codes限定参与排名的类别"""
+        codes = list(range(len(self.categories)) if codes is None else codes)
+        counts = self.counts(codes, start, end)
+        order = np.argsort(-counts, kind='stable')[:n]
+        return [(self.categories[codes[i]], int(counts[i])) for i in order if counts[i]]
+
+    def series(self, codes=None, start=None, end=None):
+        """按天的案件数, 返回 (第一天0点的墙上时间秒数, 各天案件数)"""
+        t0, t1 = self.window(start, end)
+        if t0 == t1:
+            return None, []
+        days = np.arange(t0 // HOURS_PER_DAY, -(-t1 // HOURS_PER_DAY) + 1) * HOURS_PER_DAY
+        bounds = np.clip(days, t0, t1)
+        totals = self.cum[self._slots(codes)][:, bounds].sum(axis=0)
+        first = (self.hour0 + int(days[0])) * HOUR
+        return first, np.diff(totals).tolist()
+
+    def hour_profile(self, codes=None, start=None, end=None):
+        """时间范围(按天对齐)内各整点时段(0-23时)的案件数"""
+        t0, t1 = self.window(start, end)
+        d0, d1 = t0 // HOURS_PER_DAY, -(-t1 // HOURS_PER_DAY)
+        if d0 >= d1:
+            return [0] * HOURS_PER_DAY
+        slots = self._slots(codes)
+        return (self.day_cum[slots, d1] - self.day_cum[slots, d0]).sum(axis=0).tolist()
+
+    def payload(self, version=0):
+        """stats_cube.json的内容; 最后一个类别槽为类别缺失的记录(浏览器端再求和得到全部案件)"""
+        hourly = self.hourly.copy()
+        undated = self.undated.copy()
+        hourly[-1] -= hourly[:-1].sum(axis=0)
+        undated[-1] -= undated[:-1].sum()
+        slot, hour = np.nonzero(hourly)
+        return {
+            'format': CUBE_FORMAT,
+            'version': version,
+            'rows': int(self.undated[-1] + self.cum[-1, -1]),
+            'categories': self.categories,
+            'hour0': int(self.hour0),
+            'hours': int(self.hours),
+            'slot': slot.tolist(),
+            'hour': hour.tolist(),
+            'count': hourly[slot, hour].tolist(),
+            'undated': undated.tolist(),
+        }
+
+
+def write_stats_cube(table, path=CUBE_FILE, version=0):
+    """写出stats_cube.json"""
+    return StatsCube.build(table).save(path, version)
@@ -0,0 +1,185 @@
+"""
+二维前缀和(积分图)计数表
+
+把连云港范围划分为固定的米制网格, 按 (案件类别, 月份) 统计每个格子的案件数,
+并沿 月份、行、列 三个方向做前缀和: sat[c, b, y, x] 为类别c在前b个月、前y行、前x列中的案件数。
+任意矩形 + 月份范围的计数只需8次查表(容斥), 与案件数无关; 多个类别时每个类别8次。
+最后一个类别槽为全部案件(含类别缺失的记录)。
+
+精度: 矩形按格子对齐(格子中心落在矩形内的格子计入), 时间范围按月对齐(与范围相交的月份整月计入),
+范围以外的点计入最近的边缘格子。需要精确结果时用server_data.filter_indices。
+
+增量更新: 追加新记录时只统计新记录的前缀和并加到已有表上, 新出现的类别和月份插入对应位置,
+不需要重新扫描已有数据。ingest.py在全量写出和增量导入时维护data_area.npz。
+内存约为 (类别数+1) x (月份数+1) x 格子数 x 4字节。
+"""
+
+import os
+from pathlib import Path
+
+import numpy as np
+
+from export import partition_keys
+from incident_table import NAT
+from spatial_index import DEFAULT_EXTENT, METRES_PER_DEGREE
+
+AREA_FILE = 'data_area.npz'
+DEFAULT_CELL_METRES = 250.0
+UNDATED = 'undated'
+
+
+def month_buckets(seconds):
+    """处警时间所属月份, 返回 (月份名升序, 每条记录的月份下标); 与export.partition_keys一致
+
+    先按整数月份去重, 只对不同的月份生成名称, 避免为每条记录构造字符串。
+    """
+    seconds = np.asarray(seconds, dtype=np.int64)
+    months = np.where(seconds == NAT, NAT, seconds.astype('datetime64[s]').astype('datetime64[M]').astype(np.int64))
+    unique, inverse = np.unique(months, return_inverse=True)
+    # NAT为int64最小值, 排在最前; 月份名中'undated'排在最后
+    samples = np.where(unique == NAT, NAT, unique.astype('datetime64[M]').astype('datetime64[s]').astype(np.int64))
+    labels = partition_keys(samples).astype(str)
+    order = np.argsort(labels, kind='stable')
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return labels[order].tolist(), rank[inverse]
+
+
+class SummedAreaTable:
+    """按类别和月份的二维前缀和计数表"""
+
+    def __init__(self, extent, dx, dy, nx, ny, categories, buckets, sat, rows):
+        self.extent = tuple(float(v) for v in extent)
+        self.dx, self.dy = dx, dy
+        self.nx, self.ny = nx, ny
+        self.categories = list(categories)
+        # 月份 'YYYY-MM' 升序, 无处警时间的记录在最后的'undated'中
+        self.buckets = list(buckets)
+        self.sat = sat
+        self.rows = rows
+
+    @staticmethod
+    def grid(extent=DEFAULT_EXTENT, cell_metres=DEFAULT_CELL_METRES):
+        """范围内的网格, 返回 (dx, dy, 列数, 行数); 格子在米制下为正方形"""
+        west, south, east, north = extent
+        dy = cell_metres / METRES_PER_DEGREE
+        dx = dy / np.cos(np.radians((south + north) / 2))
+        return dx, dy, int(np.ceil((east - west) / dx)), int(np.ceil((north - south) / dy))
+
+    @classmethod
+    def empty(cls, extent=DEFAULT_EXTENT, cell_metres=DEFAULT_CELL_METRES):
+        dx, dy, nx, ny = cls.grid(extent, cell_metres)
+        return cls(extent, dx, dy, nx, ny, [], [], np.zeros((1, 1, ny + 1, nx + 1), dtype=np.int32), 0)
+
+    @classmethod
+    def build(cls, table, extent=DEFAULT_EXTENT, cell_metres=DEFAULT_CELL_METRES):
+        """一次向量化计数 + 三个方向的累加"""
+        result = cls.empty(extent, cell_metres)
+        result.append(table)
+        return result
+
+    def _cells(self, lng, lat):
+        """格子的 (列, 行), 范围以外的点计入边缘格子"""
+        west, south = self.extent[:2]
+        col = np.clip(np.floor((lng - west) / self.dx), 0, self.nx - 1).astype(np.int64)
+        row = np.clip(np.floor((lat - south) / self.dy), 0, self.ny - 1).astype(np.int64)
+        return col, row
+
+    def _prefix(self, table, categories, buckets):
+        """table在给定类别和月份布局下的前缀和表"""
+        valid = np.isfinite(table.lng) & np.isfinite(table.lat)
+        col, row = self._cells(table.lng[valid], table.lat[valid])
+        labels, bucket = month_buckets(table.times['处警时间'][valid])
+        bucket = np.searchsorted(np.array(buckets, dtype=str), np.array(labels, dtype=str))[bucket]
+        # 表中的类别编码 -> 合并后的类别编码, 缺失(-1)映射到全部案件槽
+        remap = np.array([categories.index(c) for c in table.categories] + [len(categories)], dtype=np.int64)
+        code = remap[table.codes[valid]]
+
+        shape = (len(categories) + 1, len(buckets), self.ny, self.nx)
+        cells = (bucket * self.ny + row) * self.nx + col
+        size = shape[1] * shape[2] * shape[3]
+        known = code < len(categories)
+        counts = np.bincount(code[known] * size + cells[known], minlength=(shape[0] - 1) * size)
+        counts = np.concatenate([counts, np.bincount(cells, minlength=size)]).reshape(shape)
+
+        sat = np.zeros((shape[0], shape[1] + 1, shape[2] + 1, shape[3] + 1), dtype=np.int32)
+        sat[:, 1:, 1:, 1:] = counts.cumsum(axis=1).cumsum(axis=2).cumsum(axis=3)
+        return sat
+
+    def _expand(self, categories, buckets):
+        """把已有前缀和表扩展到新的类别和月份布局"""
+        sat = np.zeros((len(categories) + 1, len(buckets) + 1, self.ny + 1, self.nx + 1), dtype=np.int32)
+        # 新布局中第i个月份边界之前的旧月份数; 新插入的月份前缀和与前一个边界相同
+        old_buckets = np.array(self.buckets, dtype=str)
+        boundary = np.append(np.searchsorted(old_buckets, np.array(buckets, dtype=str)), len(self.buckets))
+        slots = [categories.index(c) for c in self.categories] + [len(categories)]
+        sat[slots] = self.sat[:, boundary]
+        return sat
+
+    def append(self, table):
+        """增量追加记录; 只扫描新记录"""
+        if not len(table):
+            return self
+        labels, _ = month_buckets(table.times['处警时间'])
+        categories = sorted(set(self.categories) | set(table.categories))
+        buckets = sorted(set(self.buckets) | set(labels))
+        if categories != self.categories or buckets != self.buckets:
+            self.sat = self._expand(categories, buckets)
+            self.categories, self.buckets = categories, buckets
+        self.sat += self._prefix(table, categories, buckets)
+        self.rows += len(table)
+        return self
+
+    def bucket_range(self, start=None, end=None):
+        """处警时间范围 -> 月份下标范围 [b0, b1); 没有时间条件时包含无处警时间的记录"""
+        if start is None and end is None:
+            return 0, len(self.buckets)
+        dated = np.array([b for b in self.buckets if b != UNDATED], dtype=str)
+        b0 = 0 if start is None else int(np.searchsorted(dated, partition_keys([start])[0], side='left'))
+        b1 = len(dated) if end is None else int(np.searchsorted(dated, partition_keys([end])[0], side='right'))
+        return b0, max(b0, b1)
+
+    def cell_range(self, bbox=None):
+        """经纬度矩形 -> 格子范围 (x0, x1, y0, y1), 左闭右开; 格子中心落在矩形内的格子计入"""
+        if bbox is None:
+            return 0, self.nx, 0, self.ny
+        west, south, east, north = bbox
+        x0 = int(np.ceil((west - self.extent[0]) / self.dx - 0.5))
+        x1 = int(np.floor((east - self.extent[0]) / self.dx - 0.5)) + 1
+        y0 = int(np.ceil((south - self.extent[1]) / self.dy - 0.5))
+        y1 = int(np.floor((north - self.extent[1]) / self.dy - 0.5)) + 1
+        x0, x1 = min(max(x0, 0), self.nx), min(max(x1, 0), self.nx)
+        y0, y1 = min(max(y0, 0), self.ny), min(max(y1, 0), self.ny)
+        return x0, max(x0, x1), y0, max(y0, y1)
+
+    def counts(self, codes=None, start=None, end=None, bbox=None):
+        """各类别在矩形和时间范围内的案件数; codes为None时返回全部案件数(长度为1的数组)"""
+        slots = [len(self.categories)] if codes is None else list(codes)
+        b0, b1 = self.bucket_range(start, end)
+        x0, x1, y0, y1 = self.cell_range(bbox)
+        # 只取8个角点, 形状为 (类别数, 2, 2, 2)
+        s = self.sat[np.ix_(slots, [b0, b1], [y0, y1], [x0, x1])].astype(np.int64)
+        return (s[:, 1, 1, 1] - s[:, 0, 1, 1] - s[:, 1, 0, 1] - s[:, 1, 1, 0]
+                + s[:, 0, 0, 1] + s[:, 0, 1, 0] + s[:, 1, 0, 0] - s[:, 0, 0, 0])
+
+    def count(self, codes=None, start=None, end=None, bbox=None):
+        """矩形和时间范围内的案件数"""
+        return int(self.counts(codes, start, end, bbox).sum())
+
+    def save(self, path):
+        """保存到.npz文件, 先写临时文件再原子替换"""
+        path = Path(path)
+        tmp = path.with_name(f".{path.stem}.{os.getpid()}.tmp.npz")
+        params = np.array([*self.extent, self.dx, self.dy, self.nx, self.ny, self.rows])
+        np.savez(tmp, params=params, categories=np.array(self.categories, dtype=str),
+                 buckets=np.array(self.buckets, dtype=str), sat=self.sat)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            params, sat = data['params'], data['sat']
+            categories, buckets = data['categories'].tolist(), data['buckets'].tolist()
+        west, south, east, north, dx, dy, nx, ny, rows = params
+        return cls((west, south, east, north), float(dx), float(dy), int(nx), int(ny),
+                   categories, buckets, sat, int(rows))
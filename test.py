@@ -4,8 +4,14 @@ from folium.plugins import HeatMap
 import webbrowser
 import os
 import sys
+import base64
 from pathlib import Path
 
+import numpy as np
+
+from data_cache import load_excel_cached
+from kde import kde
+
 # 设置中文字体支持
 import matplotlib.pyplot as plt
 plt.rcParams["font.family"] = ["SimHei", "WenQuanYi Micro Hei", "Heiti TC"]
@@ -13,33 +19,17 @@ plt.rcParams["font.family"] = ["SimHei", "WenQuanYi Micro Hei", "Heiti TC"]
 def load_excel_data(file_path):
     """加载Excel文件并提取经纬度数据"""
     try:
-        # 读取Excel文件
-        df = pd.read_excel(file_path)
-        
-        # 检查必要的列是否存在
-        required_columns = ['经度', '纬度']
-        if not all(col in df.columns for col in required_columns):
-            # 尝试寻找可能的列名变体
-            lat_cols = [col for col in df.columns if '纬度' in str(col) or 'lat' in str(col).lower()]
-            lng_cols = [col for col in df.columns if '经度' in str(col) or 'lng' in str(col).lower() or 'lon' in str(col).lower()]
-            
-            if not lat_cols or not lng_cols:
-                raise ValueError("未找到经纬度列，请确保Excel中包含'经度'和'纬度'列")
-                
-            df = df.rename(columns={lat_cols[0]: '纬度', lng_cols[0]: '经度'})
-        
-        # 过滤无效数据
-        df = df.dropna(subset=['经度', '纬度'])
-        df = df[(df['纬度'].between(-90, 90)) & (df['经度'].between(-180, 180))]
+        # 读取Excel文件(优先使用解析缓存), 匹配经纬度列并过滤无效数据
+        table = load_excel_cached(file_path)
         
-        return df[['经度', '纬度']].values.tolist()
+        return np.column_stack([table.lng, table.lat]).tolist()
         
     except Exception as e:
         print(f"数据加载错误: {str(e)}")
         return []
 
-def create_heatmap_html(coordinates, output_file='heatmap.html'):
-    """创建热点图HTML文件"""
+def create_heatmap_html(coordinates, output_file='heatmap.html', kde_bandwidth=None):
+    """创建热点图HTML文件; 给出kde_bandwidth(米)时用FFT核密度估计生成的图片叠加层代替HeatMap"""
     if not coordinates:
         print("没有可用的坐标数据，无法生成热点图")
         return False
@@ -52,7 +42,13 @@ def create_heatmap_html(coordinates, output_file='heatmap.html'):
     m = folium.Map(location=[avg_lat, avg_lng], zoom_start=10, tiles='CartoDB positron')
     
     # 添加热力图图层
-    HeatMap(coordinates, radius=15, blur=10).add_to(m)
+    if kde_bandwidth:
+        lngs, lats = np.asarray(coordinates, dtype=np.float64).T
+        surface = kde(lngs, lats, kde_bandwidth)
+        image = 'data:image/png;base64,' + base64.b64encode(surface.to_png()).decode('ascii')
+        folium.raster_layers.ImageOverlay(image=image, bounds=surface.bounds(), opacity=0.8).add_to(m)
+    else:
+        HeatMap(coordinates, radius=15, blur=10).add_to(m)
     
     # 添加标题和说明
     title_html = '''<div style="position: fixed; top: 10px; left: 50%; transform: translateX(-50%); z-index: 1000; background-color: white; padding: 10px; border-radius: 5px; box-shadow: 0 1px 5px rgba(0,0,0,0.2);">
@@ -0,0 +1,83 @@
+"""
+案件时间索引
+
+数据按处警时间排序保存一个排列(order), 再按 (类别, 处警时间) 保存每个类别的排列(cat_order),
+类别c的记录为 cat_order[cat_offsets[c]:cat_offsets[c+1]], 其中前 cat_dated[c] 条有处警时间。
+任意时间窗口或 类别+时间窗口 的查询都是两次二分查找加一个连续切片。
+index.html中的buildTimeIndex在浏览器端建立相同结构的索引(数据导出时已按处警时间排序, order即为恒等排列)。
+"""
+
+import numpy as np
+
+from export import time_order
+from incident_table import NAT
+
+
+class TimeIndex:
+    """处警时间排序索引, 查询结果为原表中的行下标(按处警时间升序)"""
+
+    def __init__(self, order, times, dated, cat_order, cat_times, cat_offsets, cat_dated):
+        self.order = order
+        # 有处警时间的记录的排序后时间, 与order的前dated项对应
+        self.times = times
+        self.dated = dated
+        self.cat_order = cat_order
+        self.cat_times = cat_times
+        self.cat_offsets = cat_offsets
+        self.cat_dated = cat_dated
+
+    @classmethod
+    def build(cls, table):
+        alarm = table.times['处警时间']
+        order = time_order(table)
+        sorted_times = alarm[order]
+        dated = int(np.count_nonzero(sorted_times != NAT))
+
+        # 按类别稳定排序, 各类别内部保持处警时间顺序; 缺失类别(-1)不进入类别索引
+        codes = table.codes[order]
+        known = codes >= 0
+        by_category = np.argsort(codes[known], kind='stable')
+        cat_order = order[known][by_category]
+        cat_times = sorted_times[known][by_category]
+        counts = np.bincount(codes[known], minlength=len(table.categories))
+        cat_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=cat_offsets[1:])
+        cat_dated = np.bincount(codes[known & (sorted_times != NAT)], minlength=len(counts))
+        return cls(order, sorted_times[:dated], dated, cat_order, cat_times, cat_offsets, cat_dated)
+
+    @staticmethod
+    def _window(times, start, end):
+        """已排序时间数组中 [start, end] 的下标范围"""
+        lo = 0 if start is None else int(np.searchsorted(times, start, side='left'))
+        hi = len(times) if end is None else int(np.searchsorted(times, end, side='right'))
+        return lo, max(lo, hi)
+
+    def ranges(self, codes=None, start=None, end=None):
+        """查询对应的 [(排列, 起, 止)]; 没有时间条件时包含无处警时间的记录"""
+        timed = start is not None or end is not None
+        if codes is None:
+            if not timed:
+                return [(self.order, 0, len(self.order))]
+            lo, hi = self._window(self.times, start, end)
+            return [(self.order, lo, hi)]
+        result = []
+        for code in codes:
+            base = int(self.cat_offsets[code])
+            if not timed:
+                result.append((self.cat_order, base, int(self.cat_offsets[code + 1])))
+                continue
+            times = self.cat_times[base:base + int(self.cat_dated[code])]
+            lo, hi = self._window(times, start, end)
+            result.append((self.cat_order, base + lo, base + hi))
+        return result
+
+    def query(self, codes=None, start=None, end=None):
+        """行下标; codes为类别编码列表, None为不限类别"""
+        parts = [perm[lo:hi] for perm, lo, hi in self.ranges(codes, start, end)]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def count(self, codes=None, start=None, end=None):
+        """匹配的记录数, 不生成下标数组"""
+        return sum(hi - lo for _, lo, hi in self.ranges(codes, start, end))
@@ -5,58 +5,55 @@ import webbrowser
 import os
 import sys  # pyright: ignore[reportUnusedImport]
 import json
+import glob
 from pathlib import Path
 
+from incident_table import IncidentTable, format_epoch
+from data_cache import load_excel_cached
+from ingest import load_excel_sources, load_excel_streaming
+from patrol_cube import PATROL_SHIFTS, PatrolCube
+
 # 设置中文字体支持
 import matplotlib.pyplot as plt
 plt.rcParams["font.family"] = ["SimHei", "WenQuanYi Micro Hei", "Heiti TC"]
 
+# 处警时间缺失时回退为第一个时间列
+REQUIRED_COLUMNS = ('经度', '纬度', '处警时间', '案件类别')
+
 class HeatmapGenerator:
-    def __init__(self, excel_path):
+    def __init__(self, excel_path, chunk_size=None, use_cache=True, workers=None):
+        # 可以是单个文件, 也可以是目录或通配符(如 'd:/data/*.xlsx')
         self.excel_path = Path(excel_path)
+        # 多工作簿并行解析的进程数, 默认为CPU核数
+        self.workers = workers
+        self.load_report = None
+        # 设置后以流式模式分块读取, 适合大文件
+        self.chunk_size = chunk_size
+        # 源文件内容未变化时直接加载解析缓存
+        self.use_cache = use_cache
         self.data = None
         self.map = None
+        # 格子 x 一周中的小时 x 类别 的时空立方体, 各班次的热力图层由它求和得到
+        self.patrol_cube = None
         
     def load_data(self):
         """加载并预处理Excel数据"""
+        # 目录或通配符: 并行加载多个工作簿, 单个文件出错不影响其余文件
+        if self.excel_path.is_dir() or glob.has_magic(str(self.excel_path)):
+            self.data, self.load_report = load_excel_sources(
+                self.excel_path, REQUIRED_COLUMNS, self.workers, self.chunk_size, self.use_cache)
+            return self.data
+
         if not self.excel_path.exists():
             raise FileNotFoundError(f"文件 '{self.excel_path}' 不存在")
             
-        df = pd.read_excel(self.excel_path)
-        
-        # 智能匹配必要列
-        column_mapping = {
-            '经度': None, '纬度': None, '案发时间': None, '案件类别': None
-        }
-        
-        # 匹配经纬度列
-        for col in df.columns:
-            col_str = str(col).lower()
-            if not column_mapping['经度'] and ('经度' in str(col) or 'lng' in col_str or 'lon' in col_str):
-                column_mapping['经度'] = col
-            if not column_mapping['纬度'] and ('纬度' in str(col) or 'lat' in col_str):
-                column_mapping['纬度'] = col
-            if not column_mapping['案发时间'] and ('时间' in str(col) or 'date' in col_str or 'time' in col_str):
-                column_mapping['案发时间'] = col
-            if not column_mapping['案件类别'] and ('类别' in str(col) or 'type' in col_str or 'category' in col_str):
-                column_mapping['案件类别'] = col
-        
-        # 检查是否找到所有必要列
-        missing_cols = [k for k, v in column_mapping.items() if v is None]
-        if missing_cols:
-            raise ValueError(f"Excel文件缺少必要列: {', '.join(missing_cols)}")
-        
-        # 重命名列
-        df = df.rename(columns={v: k for k, v in column_mapping.items()})
-        
-        # 数据清洗
-        df['案发时间'] = pd.to_datetime(df['案发时间'], errors='coerce')
-        df['经度'] = pd.to_numeric(df['经度'], errors='coerce')
-        df['纬度'] = pd.to_numeric(df['纬度'], errors='coerce')
-        df = df.dropna(subset=['经度', '纬度', '案发时间', '案件类别'])
-        df = df[(df['纬度'].between(-90, 90)) & (df['经度'].between(-180, 180))]
-        
-        self.data = df.to_dict('records')
+        # 智能匹配必要列并清洗, 结果为列式存储
+        if self.use_cache:
+            self.data = load_excel_cached(self.excel_path, REQUIRED_COLUMNS, self.chunk_size)
+        elif self.chunk_size:
+            self.data = load_excel_streaming(self.excel_path, REQUIRED_COLUMNS, self.chunk_size)
+        else:
+            self.data = IncidentTable.from_excel(self.excel_path, required=REQUIRED_COLUMNS)
         return self.data
         
     def create_heatmap(self, output_file='热力图.html'):
@@ -65,13 +62,12 @@ class HeatmapGenerator:
             raise ValueError("没有可用数据，请先调用load_data()加载数据")
             
         # 提取唯一案件类别和时间范围
-        categories = list(set(item['案件类别'] for item in self.data))
-        min_date = min(item['案发时间'] for item in self.data).strftime('%Y-%m-%d')
-        max_date = max(item['案发时间'] for item in self.data).strftime('%Y-%m-%d')
+        categories = self.data.categories
+        min_time, max_time = self.data.time_bounds('处警时间')
+        min_date, max_date = (text[:10] for text in format_epoch([min_time, max_time]))
         
         # 计算地图中心点
-        avg_lat = sum(item['纬度'] for item in self.data) / len(self.data)
-        avg_lng = sum(item['经度'] for item in self.data) / len(self.data)
+        avg_lat, avg_lng = self.data.center()
         
         # 创建地图对象
         self.map = folium.Map(location=[avg_lat, avg_lng], zoom_start=10, tiles='CartoDB positron')
@@ -84,59 +80,92 @@ class HeatmapGenerator:
                 <label style="font-family: SimHei;">案件类别:</label><br>
                 {''.join(f'<input type="checkbox" id="cat-{cat}" value="{cat}" checked> <label for="cat-{cat}">{cat}</label><br>' for cat in categories)}
             </div>
+            <div style="margin-top: 10px;">
+                <label style="font-family: SimHei;">巡防班次:</label><br>
+                <select id="patrol-shift">
+                    <option value="">全天</option>
+                    {''.join(f'<option value="{i}">{name}</option>' for i, (name, _, _) in enumerate(PATROL_SHIFTS))}
+                </select>
+                <select id="patrol-days">
+                    <option value="all">每天</option>
+                    <option value="weekday">工作日</option>
+                    <option value="weekend">周末</option>
+                </select>
+            </div>
             <button onclick="updateHeatmap()" style="margin-top: 10px; padding: 5px 10px; background-color: #0078A8; color: white; border: none; border-radius: 3px; cursor: pointer;">应用筛选</button>
         </div>
         """
         self.map.get_root().html.add_child(folium.Element(filter_html))
         
         # 添加热力图数据和JavaScript逻辑
-        # 转换Timestamp为字符串以便JSON序列化
-        serializable_data = []
-        for item in self.data:
-            serializable_item = item.copy()
-            serializable_item['案发时间'] = serializable_item['案发时间'].strftime('%Y-%m-%d %H:%M:%S')
-            serializable_data.append(serializable_item)
-        
-        data_js = f"var allData = {json.dumps(serializable_data, ensure_ascii=False)};"
+        # 页面中只嵌入稀疏的时空立方体, 切换班次和类别时按格子求和, 不再逐条筛选案件
+        self.patrol_cube = PatrolCube.build(self.data)
+        cube_js = f"var patrolCube = {json.dumps(self.patrol_cube.payload(), ensure_ascii=False)};"
+        shifts_js = f"var patrolShifts = {json.dumps([[s, e] for _, s, e in PATROL_SHIFTS])};"
         heatmap_js = f"""
         <script src="https://unpkg.com/leaflet.heat/dist/leaflet-heat.js"></script>
         <script>
-            {data_js}
+            {cube_js}
+            {shifts_js}
             var map = L.map('map').setView([{avg_lat}, {avg_lng}], 12); // 设定中心和缩放
-            L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {{
+            L.tileLayer('https://{{s}}.tile.openstreetmap.org/{{z}}/{{x}}/{{y}}.png', {{
                 attribution: '© OpenStreetMap contributors'
             }}).addTo(map);
-
-            var heatData = allData.map(item => [item.纬度, item.经度, 1]);
-            var heat = L.heatLayer(heatData, {{radius: 25, blur: 15}}).addTo(map);
             
             var heatmapLayer;
             
-            // 初始化热力图
-            function initHeatmap() {{
-                var initialData = allData.map(item => [item.纬度, item.经度, 1]);
-                heatmapLayer = L.heatLayer(initialData, {{radius: 25, blur: 15}}).addTo(map);
+            // 班次对应的一周中的小时(周一0时为0), 跨到次日的小时计入次日
+            function shiftBuckets(startHour, endHour, weekdays) {{
+                var buckets = new Set();
+                weekdays.forEach(day => {{
+                    for (var hour = startHour; hour < endHour; hour++) {{
+                        buckets.add((day * 24 + hour) % 168);
+                    }}
+                }});
+                return Array.from(buckets);
+            }}
+            
+            // 取出选中 (类别, 小时) 的各段按格子求和, 返回格子中心的热力点
+            function cubeLayer(buckets, codes) {{
+                var [west, south, dx, dy, nx] = patrolCube.grid;
+                var totals = new Map();
+                codes.forEach(code => {{
+                    buckets.forEach(bucket => {{
+                        var slot = code * 168 + bucket;
+                        for (var k = patrolCube.offsets[slot]; k < patrolCube.offsets[slot + 1]; k++) {{
+                            var cell = patrolCube.cells[k];
+                            totals.set(cell, (totals.get(cell) || 0) + patrolCube.counts[k]);
+                        }}
+                    }});
+                }});
+                return Array.from(totals, ([cell, count]) => [
+                    south + (Math.floor(cell / nx) + 0.5) * dy,
+                    west + (cell % nx + 0.5) * dx,
+                    count
+                ]);
             }}
             
             // 更新热力图数据
             function updateHeatmap() {{
-                var selectedCategories = [];
                 // 获取选中的类别
-                {json.dumps(categories)}.forEach(cat => {{
+                var codes = [];
+                patrolCube.categories.forEach((cat, code) => {{
                     if (document.getElementById('cat-' + cat).checked) {{
-                        selectedCategories.push(cat);
+                        codes.push(code);
                     }}
                 }});
-                // 筛选数据
-                var filteredData = allData.filter(item => selectedCategories.includes(item.案件类别)).map(item => [item.纬度, item.经度, 1]);
+                // 班次和星期几
+                var shift = document.getElementById('patrol-shift').value;
+                var days = {{all: [0, 1, 2, 3, 4, 5, 6], weekday: [0, 1, 2, 3, 4], weekend: [5, 6]}}[document.getElementById('patrol-days').value];
+                var buckets = shift === '' ? shiftBuckets(0, 24, days) : shiftBuckets(patrolShifts[shift][0], patrolShifts[shift][1], days);
                 // 更新图层
                 if (heatmapLayer) {{
                     map.removeLayer(heatmapLayer);
                 }}
-                heatmapLayer = L.heatLayer(filteredData, {{radius: 25, blur: 15}}).addTo(map);
+                heatmapLayer = L.heatLayer(cubeLayer(buckets, codes), {{radius: 25, blur: 15}}).addTo(map);
             }}
             // 页面加载完成后初始化
-            document.addEventListener('DOMContentLoaded', initHeatmap);
+            document.addEventListener('DOMContentLoaded', updateHeatmap);
         </script>
         """
         self.map.get_root().html.add_child(folium.Element(heatmap_js))